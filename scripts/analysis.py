@@ -132,13 +132,15 @@ def analyze_disagreements(repo: LocalRepo, views: List[str], target_patterns: Pa
 
 
 def find_disagreement_results_serial_cpp(analysis_graphs: List[CouplingGraph], target_patterns: PatternsType, all_nodes: List[str]) -> List[BestResultsSet]:
-    ns = graph_manager.create_node_set(all_nodes)
+    manager = analysis_graphs[0].manager
+    analysis_graphs = [g.on_manager(manager) for g in analysis_graphs]
+    ns = manager.create_node_set(all_nodes)
 
     # "findDisagreements", "nodeSetId resultSize graphAmount graphs... patternsComponents...
-    fixed_args = ["findDisagreements", str(ns), str(SHOW_RESULTS_SIZE), str(len(analysis_graphs))]
-    graph_args = [str(g.id) for g in analysis_graphs]
-    patterns_args = ["nan" if v is None else str(v) for pattern in target_patterns for v in pattern[:len(analysis_graphs)]]
-    raw_results = graph_manager.execute_strings(fixed_args + graph_args + patterns_args)
+    fixed_args = ["findDisagreements", ns.id, SHOW_RESULTS_SIZE, len(analysis_graphs)]
+    graph_args = [np.array([g.id for g in analysis_graphs])]
+    patterns_args = [np.array([math.nan if v is None else v for pattern in target_patterns for v in pattern[:len(analysis_graphs)]], dtype=np.float64)]
+    raw_results = manager.execute_values(fixed_args + graph_args + patterns_args)
 
     pattern_results = [
         BestResultsSet(sum(type(x) == int for x in p) + 1, SHOW_RESULTS_SIZE)  # one dim for each graph that is used in the pattern + 1 for support
@@ -149,7 +151,7 @@ def find_disagreement_results_serial_cpp(analysis_graphs: List[CouplingGraph], t
 
     all_dim_count = len(analysis_graphs) + 1  # and support
     while result_i < len(raw_results):
-        if len(raw_results[result_i]) == 0:
+        if raw_results[result_i] == "":
             result_i += 1
             brs_i += 1
         else:
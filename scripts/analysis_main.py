@@ -61,7 +61,7 @@ for repo in all_new_repos:
         ], node_filter_mode, ignore_previous_results=False)
         print([len(r.data) for r in results])
 
-graph_manager.flush()
+graph_managers.flush()
 print("\nProgram is over!")
 
 """
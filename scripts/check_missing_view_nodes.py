@@ -18,7 +18,7 @@ def get_all_view_nodes(r: LocalRepo, view: str) -> Set[str]:
         return set([m for m in (get_all_nodes(r)) if g.similarity_has_node(m)])
     elif view in {"references", "evolutionary"}:
         g: ExplicitCouplingGraph = MetricManager.get(r, view, ignore_post_processing=True)
-        return set(g.get_data()[0]).intersection(get_all_nodes(r))
+        return set(g.export_data().node_names()).intersection(get_all_nodes(r))
     raise Exception("No")
 
 
@@ -1,15 +1,16 @@
 from __future__ import annotations
 
 import ternary
+from ternary.helpers import normalize, simplex_iterator
 from matplotlib import pyplot as plt
 from cachier import cachier
 from local_repo import LocalRepo
 from metrics import MetricManager
 from metrics_evolutionary import get_commit_diff
-from graph import CombinedCouplingGraph, CachedCouplingGraph, CouplingGraph, graph_manager
+from graph import CombinedCouplingGraph, CachedCouplingGraph, CouplingGraph, NodeSet, graph_managers
 from prcoessify import processify
 from plotting import parallel_coordinates
-from util import log_progress, generate_one_distributions
+from util import generate_one_distributions
 from typing import *
 
 repos = [
@@ -47,7 +48,7 @@ def node_filter(tree_node):
     return tree_node is not None and tree_node.get_type() == "method" and tree_node.get_line_span() >= 1
 
 
-nodes_tests_cache: dict[str, Tuple[int, List[tuple[str, List[str]]]]] = {}
+nodes_tests_cache: dict[str, Tuple[NodeSet, List[tuple[str, List[str]]]]] = {}
 graph_cache: dict[str, List[CouplingGraph]] = {}
 def get_nodes_and_tests(repo: str):
     if repo not in nodes_tests_cache:
@@ -63,7 +64,7 @@ def get_nodes_and_tests(repo: str):
                 prediction_tests.append((method_to_predict, other_methods))
         # nodeset_id = graph_manager.create_node_set(all_nodes)
         # nodes_tests_cache[repo] = (nodeset_id, prediction_tests)
-        all_nodes_ns = graph_manager.create_node_set(all_nodes)
+        all_nodes_ns = graph_managers.for_repo(r.name).create_node_set(all_nodes)  # where the metric graphs of this repo live
         nodes_tests_cache[repo] = (all_nodes_ns, prediction_tests)
         print("Total method nodes: " + str(len(all_nodes)))
         print("Total future tests: " + str(len(prediction_tests)))
@@ -75,13 +76,17 @@ def get_graphs(repo: str):
 
 
 @cachier()
-def get_commit_prediction_score_cpp(repo: str, weights: Tuple[float]):
+def get_commit_prediction_scores_cpp(repo: str, weight_combinations: Tuple[Tuple[float, ...], ...]) -> List[float]:
+    """the mean prediction score of each weight combination, all evaluated at once"""
     all_nodes, prediction_tests = get_nodes_and_tests(repo)
-    scores = []
-    combined_graph = CombinedCouplingGraph(get_graphs(repo), weights)
-    for missing, others in prediction_tests:
-        scores.append(combined_graph.how_well_predicts_missing_node(others, missing, all_nodes))
-    return sum(scores) / len(scores)
+    with CombinedCouplingGraph(get_graphs(repo)) as combined_graph:
+        tests = combined_graph.manager.register_prediction_tests(prediction_tests)
+        scores = combined_graph.how_well_predicts_missing_nodes_for_weights(weight_combinations, tests, all_nodes)
+    return scores.mean(axis=1).tolist()
+
+
+def get_commit_prediction_score_cpp(repo: str, weights: Tuple[float]):
+    return get_commit_prediction_scores_cpp(repo, (tuple(weights),))[0]
 
 
 for repo in repos:
@@ -95,15 +100,18 @@ for repo in repos:
 
     scale = 8
     results = []
-    weight_combinations = list(generate_one_distributions(len(metrics), scale))
-    for weights in log_progress(weight_combinations, desc="Evaluating view weight combinations"):
-        score = get_commit_prediction_score_cpp(repo, tuple(weights))
+    weight_combinations = [tuple(weights) for weights in generate_one_distributions(len(metrics), scale)]
+    for weights, score in zip(weight_combinations, get_commit_prediction_scores_cpp(repo, tuple(weight_combinations))):
         score = score ** 1  # todo make this power slider interactive?
         results.append((", ".join(str(w) for w in weights), score))
     results.sort(key=lambda e: e[1])
     for res in results:
         print(res[0] + ", " + str(res[1]))
 
+    # all weights of the ternary plots below (which calls ternary_fn with the normalized simplex points), so that they are evaluated together as well
+    ternary_weights = [tuple(tw[:mi] + [0] + tw[mi:]) for mi in range(len(metrics)) for tw in (normalize(list(p)) for p in simplex_iterator(scale, boundary=True))]
+    ternary_scores = dict(zip(ternary_weights, get_commit_prediction_scores_cpp(repo, tuple(ternary_weights))))
+
     fig, axes = plt.subplots(1, 4, figsize=(15, 3), constrained_layout=True)
     fig.suptitle(r.display_name() + " - How well can view combinations complete future commits?")
     for mi, omitted_metric in enumerate(metrics):
@@ -112,7 +120,9 @@ for repo in repos:
         def ternary_fn(tw):
             weights = tw[:]
             weights.insert(mi, 0)
-            return get_commit_prediction_score_cpp(repo, tuple(weights)) ** 5
+            if tuple(weights) not in ternary_scores:
+                ternary_scores[tuple(weights)] = get_commit_prediction_score_cpp(repo, tuple(weights))
+            return ternary_scores[tuple(weights)] ** 5
 
         tax = ternary.TernaryAxesSubplot(ax=axes[mi], scale=scale)
         tax.heatmapf(ternary_fn, boundary=True,
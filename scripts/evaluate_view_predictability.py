@@ -10,7 +10,7 @@ import matplotlib.pyplot as plt
 import pyfiglet
 import ternary
 
-from graph import CouplingGraph
+from graph import CouplingGraph, get_normalized_couplings_of_graphs
 from local_repo import LocalRepo
 from metrics import MetricManager
 from util import log_progress, all_pairs, score_sorting_similarity
@@ -53,7 +53,7 @@ def get_metric_values(repo: str, max_node_pairs_to_check=100000) -> List[List[fl
         else:
             print("Node pair amount " + str(len(node_pairs)) + " does not exceed " + str(max_node_pairs_to_check) + ", all are used")
             random.shuffle(node_pairs)
-        repo_metric_values_cache[repo] = [[g.get_normalized_coupling(a, b) for g in graphs] for a, b in log_progress(node_pairs, desc="getting coupling values")]
+        repo_metric_values_cache[repo] = get_normalized_couplings_of_graphs(graphs, node_pairs).tolist()
     return repo_metric_values_cache[repo]
 
 
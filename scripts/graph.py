@@ -1,85 +1,570 @@
+import atexit
+import itertools
+import json
+import math
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import zlib
 import os
+import time
+import weakref
+from collections import defaultdict, OrderedDict
+from functools import wraps
 from typing import *
 
-from util import log_progress, show_histogram
+import numpy as np
+
+from graph_protocol import Command, UINT32, encode_frame, decode_frame, to_text_parts
+from graph_journal import GraphJournal, ObjectKey, translate_ids, RELEASING_COMMANDS
+from util import log_progress, show_histogram, K, T
 
 CPP_GRAPH_CLI_PATH = os.getenv("COUPLING_GRAPH_EXECUTABLE", "/home/ebrendel/util/mvmm-graphs/coupling_graphs")
 METRICS_SAVE_PATH = "../metrics/"
+GRAPH_PROTOCOL = os.getenv("COUPLING_GRAPH_PROTOCOL", "text")  # "text" or "binary", the latter is negotiated at startup
+GRAPH_BACKEND = os.getenv("COUPLING_GRAPH_BACKEND", "process")  # "python" runs all commands in-process, see graph_backend.py
+GRAPH_PROCESSES = int(os.getenv("COUPLING_GRAPH_PROCESSES", "1"))  # graphs are sharded by repo name across this many graph processes
+JOURNAL = os.getenv("COUPLING_GRAPH_JOURNAL", "0") == "1"  # restart crashed graph processes and restore their graphs, see graph_journal.py
+JOURNAL_CHECKPOINT_INTERVAL = int(os.getenv("COUPLING_GRAPH_CHECKPOINT_INTERVAL", "1000"))  # journaled changes of a graph before it is saved instead
+JOURNAL_CHECKPOINT_BYTES = int(os.getenv("COUPLING_GRAPH_CHECKPOINT_BYTES", str(64 * 1024 * 1024)))  # or journaled payload bytes, for bulk changes
+JOURNAL_DIRECTORY = os.getenv("COUPLING_GRAPH_JOURNAL_DIRECTORY")  # for the checkpoints, a new temp dir if not set
 LOG_COMMANDS = False
+STATS_FILE = os.getenv("COUPLING_GRAPH_STATS_FILE")  # if set, command stats are dumped there as json. Can contain {pid} and {manager}
+STATS_DUMP_INTERVAL = float(os.getenv("COUPLING_GRAPH_STATS_INTERVAL", "60"))  # seconds
+RECORD_FILE = os.getenv("COUPLING_GRAPH_RECORD_FILE")  # if set, all commands are recorded there for graph_replay.py. Can contain {pid} and {manager}
+COUPLING_CACHE_SIZE = 1000000  # default amount of values that an LRUCachedCouplingGraph keeps
+BULK_BATCH_SIZE = 100000  # how many distinct entries are sent to the graph process in one bulk command
+# bytes of unanswered pipelined commands: the graph process stops reading while its own answers are not read,
+# so everything sent meanwhile has to fit into the (usually 64 KiB) pipe buffer, or both sides block writing
+PIPELINE_MAX_IN_FLIGHT_BYTES = 32 * 1024
 
 
-class GraphManager:
+class CommandStats:
+    """counters for all executions of one command, see GraphManager.stats"""
+
     def __init__(self):
+        self.count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.send_time = 0.0
+        self.wait_time = 0.0  # blocked while reading the results
+        self.parse_time = 0.0  # reading time that was not spent waiting
+        self.latency_time = 0.0
+        self.latency_histogram: Dict[int, int] = defaultdict(int)  # by upper bound in microseconds, powers of two
+
+    def add_latency(self, seconds: float):
+        self.latency_time += seconds
+        self.latency_histogram[2 ** max(0, math.ceil(math.log2(max(1.0, seconds * 1000000))))] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        latency_count = sum(self.latency_histogram.values())
+        return {
+            "count": self.count,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "send_seconds": self.send_time,
+            "wait_seconds": self.wait_time,
+            "parse_seconds": self.parse_time,
+            "latency_seconds": self.latency_time,
+            "mean_latency_ms": self.latency_time / latency_count * 1000 if latency_count > 0 else 0.0,
+            "latency_histogram_us": {f"<={bound}": amount for bound, amount in sorted(self.latency_histogram.items())},
+        }
+
+
+_manager_numbers = itertools.count()
+_reported_missing_capabilities = False  # that warning is the same for every graph process, so it is only printed once
+
+
+class GraphManager:
+    def __init__(self, protocol: str = GRAPH_PROTOCOL, journal: bool = JOURNAL):
+        self.protocol = protocol
+        number = self._init_fields(GraphJournal(JOURNAL_CHECKPOINT_INTERVAL, JOURNAL_CHECKPOINT_BYTES, JOURNAL_DIRECTORY) if journal else None)
+        self._start_process()
+        self._init_recording(number)  # after the protocol negotiation, which the replay does on its own
+
+    def _init_fields(self, journal: Optional[GraphJournal]) -> int:
+        """the state that all managers share, returns the number of this manager for the names of its stats and recording files"""
+        self.next_request_id = 0
+        self.pending_requests: Dict[int, GraphFuture] = {}  # by request id, in the order they were sent
+        self.in_flight_bytes = 0  # estimated size of the pending requests, see PIPELINE_MAX_IN_FLIGHT_BYTES
+        self.node_ids: Dict[str, int] = {}  # registered nodes, see register_nodes
+        self.node_names: Dict[int, str] = {}
+        self.pending_releases: List[Command] = []  # of garbage collected handles, sent along with the next command
+        self.handles: weakref.WeakSet = weakref.WeakSet()  # graphs and node sets, to update their ids after a restart
+        self.journal = journal
+        self.recovering = False
+        self.recording = None
+        number = next(_manager_numbers)
+        self._init_stats(number)
+        return number
+
+    def _start_process(self):
         self.process = subprocess.Popen(
             [CPP_GRAPH_CLI_PATH],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            # in binary mode, stderr output mixed into stdout would corrupt the frames
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT if self.protocol == "text" else None
         )
         self.current_progress_bar = None
         self.progress_name: Optional[str] = None
-
-    def execute_void(self, commands: List[str]) -> None:
-        for part in commands:
-            if "|" in part:
-                raise Exception("Found | in command! '" + part + "'")
-            if "\n" in part:
-                raise Exception("Found line break in command! '" + part.replace("\n", "\\n") + "'")
-        cmd = "|".join(commands) + "\n"
+        self.binary = False
+        self._negotiate_capabilities()
+        if self.protocol == "binary":
+            self._negotiate_binary_protocol()
+
+    def _can_recover(self) -> bool:
+        return self.journal is not None and not self.recovering and self.process.poll() is not None
+
+    def _recover(self) -> Dict[ObjectKey, int]:
+        """restart the crashed graph process and replay the journal, returns the new ids of all restored objects"""
+        print(f"[G] Graph process terminated with {self.process.returncode}, restarting it and restoring {len(self.journal.entries)} objects...")
+        sys.stdout.flush()
+        self.recovering = True  # which also holds back releases, as their ids are only translated afterwards
+        # set aside, as they are re-sent after restoring, and nothing must wait for their results before
+        pending, self.pending_requests, self.in_flight_bytes = list(self.pending_requests.values()), {}, 0
+        try:
+            self._start_process()
+            self._restore_registered_nodes()
+            id_map: Dict[ObjectKey, int] = {}
+            entries, self.journal.entries = self.journal.entries, {}
+            for key, (creation, *changes) in log_progress(list(entries.items()), desc="[G] Restoring graphs"):
+                id_map[key] = self.execute_int(translate_ids(creation, id_map))  # journaled again by _execute
+                for change in changes:
+                    self.execute_void(translate_ids(change, id_map))
+        finally:
+            self.recovering = False
+        for handle in list(self.handles):
+            key = (handle.handle_kind, handle.id)
+            if key in id_map:
+                handle._remap(id_map[key])
+        self.pending_releases = [translate_ids(r, id_map) for r in self.pending_releases if (RELEASING_COMMANDS[r[0]], int(r[1])) in id_map]
+        for future in pending:
+            future.commands = translate_ids(future.commands, id_map)
+            self._send_pipelined(future)
+        return id_map
+
+    def _restore_registered_nodes(self):
+        if len(self.node_names) == 0:
+            return
+        node_ids = sorted(self.node_names)
+        node_names = [self.node_names[node_id] for node_id in node_ids]
+        self.node_ids.clear()
+        self.node_names.clear()
+        if self.register_nodes(node_names).tolist() != node_ids:
+            raise Exception("Restarted graph process assigned different node ids!")
+
+    def _checkpoint(self, key: ObjectKey):
+        """save the graph, so that it can be loaded instead of replaying all its changes"""
+        repo_name, name, path = self.journal.next_checkpoint(key)
+        self.execute_void(["save", key[1], repo_name, path])
+        self.flush()  # to be sure that it is saved completely
+        self.journal.set_checkpoint(key, ["load", repo_name, name, path])
+
+    def _negotiate_capabilities(self):
+        """find out which commands beyond the original ones the graph process knows, see supports"""
+        try:
+            self.capabilities = set(self.execute_strings(["getCapabilities"]))
+        except Exception as e:
+            global _reported_missing_capabilities
+            if not _reported_missing_capabilities:
+                print("[G] Graph process does not report its capabilities, only using the original commands: " + str(e))
+                _reported_missing_capabilities = True
+            self._resync()
+            self.capabilities = set()
+
+    def supports(self, command: str) -> bool:
+        """whether the graph process knows this command, for those that were added after the original coupling graph executable"""
+        return command in self.capabilities
+
+    def _negotiate_binary_protocol(self):
+        try:
+            answer = self.execute_string(["setProtocol", "binary"])
+        except Exception as e:
+            print("[G] Graph process does not support the binary protocol, staying with text: " + str(e))
+            self._resync()
+            return
+        # the answer is the last text line, everything after it is framed
+        self.binary = answer == "binary"
+
+    def _resync(self):
+        """skip any output that is still left over from a failed command"""
+        token = "resync" + str(time.time_ns())
+        self._send(["echo", token])
+        while self._read_line() != "#result " + token:
+            pass
+
+    def _init_recording(self, number: int):
+        self.recording = None
+        if RECORD_FILE is not None:
+            self.recording = open(RECORD_FILE.format(pid=os.getpid(), manager=number), "wb")
+            atexit.register(self.recording.close)
+
+    def _record(self, kind: str, commands: Command):
+        """
+        one binary protocol frame per command, so that typed arrays stay typed: its kind, then the command.
+        Kinds: "v" void, "r" waits for the result, "p" pipelined
+        """
+        if self.recording is not None and not self.recovering:
+            self.recording.write(encode_frame([kind] + commands))
+
+    def _init_stats(self, number: int):
+        self.command_stats: Dict[str, CommandStats] = defaultdict(CommandStats)
+        self.read_wait_time = 0.0  # totals of all reads, to attribute the differences to the commands
+        self.bytes_read = 0
+        self.stats_file = None
+        self.last_stats_dump = time.time()
+        if STATS_FILE is not None:
+            self.stats_file = STATS_FILE.format(pid=os.getpid(), manager=number)
+            atexit.register(self.dump_stats)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """per command name: counts, bytes, times in seconds and a latency histogram"""
+        return {name: stats.to_dict() for name, stats in self.command_stats.items()}
+
+    def print_stats(self):
+        print(f"{'command':<32}{'count':>10}{'sent MB':>10}{'recv MB':>10}{'wait s':>10}{'parse s':>10}{'mean ms':>10}")
+        for name, stats in sorted(self.stats().items(), key=lambda entry: -entry[1]["latency_seconds"] - entry[1]["send_seconds"]):
+            print(f"{name:<32}{stats['count']:>10}{stats['bytes_sent'] / 1e6:>10.2f}{stats['bytes_received'] / 1e6:>10.2f}"
+                  f"{stats['wait_seconds']:>10.2f}{stats['parse_seconds']:>10.2f}{stats['mean_latency_ms']:>10.3f}")
+
+    def reset_stats(self):
+        self.command_stats.clear()
+
+    def dump_stats(self, path: Optional[str] = None):
+        path = self.stats_file if path is None else path
+        with open(path, "w") as f:
+            json.dump({"time": time.time(), "commands": self.stats()}, f, indent=2)
+        self.last_stats_dump = time.time()
+
+    def _stats_of(self, commands: Command) -> CommandStats:
+        name = commands[0]
+        if name.startswith("@"):  # pipelined
+            name = commands[1]
+        return self.command_stats[name]
+
+    def _dump_stats_periodically(self):
+        if self.stats_file is not None and time.time() - self.last_stats_dump > STATS_DUMP_INTERVAL:
+            self.dump_stats()
+
+    def execute_void(self, commands: Command) -> None:
+        self._record("v", commands)
+        self._send(commands)
+
+    def _send(self, commands: Command) -> None:
+        self.send_releases()
+        commands = self._make_room(commands)
+        start = time.perf_counter()
+        if self.binary:
+            data = encode_frame(commands)
+        else:
+            for part in to_text_parts(commands):
+                if "|" in part:
+                    raise Exception("Found | in command! '" + part + "'")
+                if "\n" in part:
+                    raise Exception("Found line break in command! '" + part.replace("\n", "\\n") + "'")
+            data = (_describe(commands) + "\n").encode("utf-8")
         if LOG_COMMANDS:
-            print("[CG] " + cmd[:-1])
+            print("[CG] " + _describe(commands))
         try:
-            self.process.stdin.write(cmd.encode("utf-8"))
+            self.process.stdin.write(data)
             self.process.stdin.flush()
         except BrokenPipeError as e:
-            print("Command failed: " + cmd[:-1])
+            if self._can_recover():
+                self._send(translate_ids(commands, self._recover()))
+                return
+            print("Command failed: " + _describe(commands))
             raise e
+        if self.journal is not None:
+            checkpoint_key = self.journal.record_sent(commands)
+            if checkpoint_key is not None:
+                self._checkpoint(checkpoint_key)
+        stats = self._stats_of(commands)
+        stats.count += 1
+        stats.bytes_sent += len(data)
+        stats.send_time += time.perf_counter() - start
+        self._dump_stats_periodically()
+
+    def execute_string(self, commands: Command) -> str:
+        return self._result_to_string(self._execute(commands))
+
+    def execute_values(self, commands: Command) -> List[Any]:
+        """the result as list of values: strings in the text protocol, typed values and numpy arrays in the binary one"""
+        result = self._execute(commands)
+        if self.binary:
+            return result
+        if len(result) == 0:
+            return []
+        return result.split("|")
 
-    def execute_string(self, commands: List[str]) -> str:
-        self.execute_void(commands)
-        line = self._read_line()
-        while not line.startswith("#result"):
-            if line.startswith("#progress "):
-                progress_parts = line[len("#progress "):].split(" ", 2)
-                self._show_progress(int(progress_parts[0]), int(progress_parts[1]), progress_parts[2])
-            else:
-                if "Unknown command" in line:
-                    raise Exception(f"LAST COMMAND FAILED: {'|'.join(commands)} | Error message: {line}")
-                if len(line) > 0:
-                    print("[G] " + line)
-                    sys.stdout.flush()
-            line = self._read_line()
-        return line[len("#result"):].lstrip()
+    def _execute(self, commands: Command) -> Union[str, List[Any]]:
+        self._record("r", commands)
+        return self._send_and_read(commands)
 
-    def execute_int(self, commands: List[str]) -> int:
+    def _send_and_read(self, commands: Command) -> Union[str, List[Any]]:
+        start = time.perf_counter()
+        try:
+            self._send(commands)
+            while True:
+                request_id, result = self._read_result(commands)
+                if request_id is None:
+                    break
+        except Exception:
+            if not self._can_recover():
+                raise
+            self.journal.forget_last_change(commands)  # it is sent again, after all the others are restored
+            return self._send_and_read(translate_ids(commands, self._recover()))
+        self._stats_of(commands).add_latency(time.perf_counter() - start)
+        if self.journal is not None:
+            self.journal.record_result(commands, self._result_to_string(result))
+        return result
+
+    def submit(self, commands: Command, convert: Callable[[str], T] = str) -> 'GraphFuture[T]':
+        """pipelined execution: send the command tagged with a request id, without waiting for its result"""
+        return self._submit(GraphFuture(self, commands, convert))
+
+    def _submit(self, future: 'GraphFuture[T]') -> 'GraphFuture[T]':
+        if not self.supports("pipelined"):
+            # the original c++ executable does not know request ids
+            try:
+                future._resolve(self._execute(future.commands))
+            except Exception as e:
+                if not future.log_errors:
+                    raise
+                print(f"[G] Ignoring failed {_describe(future.commands)}: {e}")
+            return future
+        self._send_pipelined(future)
+        return future
+
+    def _send_pipelined(self, future: 'GraphFuture'):
+        self.send_releases()  # before taking a request id, as they are pipelined themselves
+        future.commands = self._make_room(future.commands)  # so that _send does not have to wait anymore
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        self._record("p", future.commands)
+        self._send(["@" + str(request_id)] + future.commands)
+        self.pending_requests[request_id] = future  # only now, as restoring after a crash while sending re-sends all pending ones
+        future.size = _estimated_size(future.commands)
+        self.in_flight_bytes += future.size
+
+    def _make_room(self, commands: Command) -> Command:
+        """wait for pipelined results until the commands fit into the pipe, returns them with new ids if the process was restarted meanwhile"""
+        size = _estimated_size(commands)
+        while len(self.pending_requests) > 0 and self.in_flight_bytes + size > PIPELINE_MAX_IN_FLIGHT_BYTES:
+            id_map = self._read_pending_result(next(iter(self.pending_requests.values())))
+            if id_map is not None:
+                commands = translate_ids(commands, id_map)
+        return commands
+
+    def _read_pending_result(self, future: 'GraphFuture') -> Optional[Dict[ObjectKey, int]]:
+        """the new ids of all restored objects, if the graph process had to be restarted"""
+        try:
+            self._read_result(future.commands)
+        except Exception:
+            if not self._can_recover():
+                raise
+            return self._recover()  # which also re-sends all pending commands
+        return None
+
+    def execute_pipelined(self, commands_list: Iterable[Command], convert: Callable[[str], T] = str) -> List[T]:
+        futures = [self.submit(commands, convert) for commands in commands_list]
+        return [future.result() for future in futures]
+
+    def execute_int(self, commands: Command) -> int:
         return int(self.execute_string(commands))
 
-    def execute_float(self, commands: List[str]) -> float:
+    def execute_float(self, commands: Command) -> float:
         return float(self.execute_string(commands))
 
-    def execute_strings(self, commands: List[str]) -> List[str]:
+    def execute_strings(self, commands: Command) -> List[str]:
+        if self.binary:
+            return to_text_parts(self._execute(commands))
         result = self.execute_string(commands)
         if len(result) == 0:
             return []
         return result.split("|")
 
-    def create_node_set(self, nodes: List[str]):
-        return self.execute_int(["createNodeSet"] + nodes)
-
-    def get_node_set(self, node_set_id: int):
-        return self.execute_strings(["getNodeSet", str(node_set_id)])
+    def register_nodes(self, nodes: Sequence[str]) -> np.ndarray:
+        """the integer ids of these nodes, which can be used instead of their names in the ...Ids commands"""
+        new_nodes = list(dict.fromkeys(node for node in nodes if node not in self.node_ids))
+        if not self.supports("registerNodes"):
+            # then the ids only exist on this side, and the ...Ids commands fall back to the node names
+            for node in new_nodes:
+                self.node_names[len(self.node_ids)] = node
+                self.node_ids[node] = len(self.node_ids)
+            new_nodes = []
+        for start in range(0, len(new_nodes), BULK_BATCH_SIZE):
+            batch = new_nodes[start:start + BULK_BATCH_SIZE]
+            values = self.execute_values(["registerNodes", batch])
+            for node, node_id in zip(batch, values[0] if self.binary else values):
+                self.node_ids[node] = int(node_id)
+                self.node_names[int(node_id)] = node
+        return np.fromiter((self.node_ids[node] for node in nodes), dtype=np.int32, count=len(nodes))
+
+    def node_names_of(self, node_ids: Iterable[int]) -> List[str]:
+        return [self.node_names[int(node_id)] for node_id in node_ids]
+
+    def create_node_set(self, nodes: Union[List[str], np.ndarray]) -> 'NodeSet':
+        """from node names or registered node ids"""
+        if not self.supports("createNodeSetIds"):
+            return NodeSet(self, self.execute_int(["createNodeSet", self.node_names_of(nodes) if _is_id_array(nodes) else list(nodes)]))
+        if not _is_id_array(nodes):
+            nodes = self.register_nodes(nodes)
+        return NodeSet(self, self.execute_int(["createNodeSetIds", nodes]))
+
+    def register_prediction_tests(self, tests: Sequence[Tuple[str, Sequence[str]]]) -> 'PredictionTests':
+        """(missing node, other nodes) tests for how_well_predicts_missing_nodes, with their nodes registered"""
+        missing_nodes = self.register_nodes([missing for missing, _others in tests])
+        other_nodes = self.register_nodes([node for _missing, others in tests for node in others])
+        offsets = np.zeros(len(tests) + 1, dtype=np.int32)
+        np.cumsum([len(others) for _missing, others in tests], out=offsets[1:])
+        return PredictionTests(self, missing_nodes, offsets, other_nodes)
+
+    def get_node_set(self, node_set_id: Union[int, 'NodeSet']):
+        return self.execute_strings(["getNodeSet", int(node_set_id)])
+
+    def release_later(self, commands: Command):
+        """called by finalizers, which might run in the middle of another command, so the release is only sent later"""
+        self.pending_releases.append(commands)
+
+    def send_releases(self):
+        if len(self.pending_releases) > 0 and not self.recovering:
+            releases, self.pending_releases = self.pending_releases, []
+            for release in releases:
+                self.send_release(release)
+
+    def send_release(self, commands: Command):
+        """fire and forget: a failed release is only logged, instead of failing whatever command is read next"""
+        if not self.supports(commands[0]):
+            return  # then the graph process cannot free anything anyway
+        self._submit(GraphFuture(self, commands, str, log_errors=True))
+
+    def memory_report(self) -> List[Tuple[str, int, str, int]]:
+        """(kind, id, name, estimated bytes) for each graph and node set that currently exists in the graph process"""
+        return [(kind, int(object_id), name, int(size)) for kind, object_id, name, size in
+                (entry.split(";") for entry in self.execute_strings(["memoryReport"]))]
+
+    def print_memory_report(self):
+        report = self.memory_report()
+        for kind, object_id, name, size in sorted(report, key=lambda entry: -entry[3]):
+            print(f"{size / 1024 / 1024:10.2f} MB  {kind} {object_id} {name}")
+        print(f"{sum(entry[3] for entry in report) / 1024 / 1024:10.2f} MB  total")
+
+    def _result_to_string(self, result: Union[str, List[Any]]) -> str:
+        if not self.binary:
+            return result
+        if len(result) == 1 and isinstance(result[0], str):
+            return result[0]
+        return "|".join(to_text_parts(result))
+
+    def _read_result(self, commands: Command) -> Tuple[Optional[int], Union[str, List[Any]]]:
+        """read up to the next result, returning its request id (None if it was untagged) and content"""
+        start, wait_before, read_before = time.perf_counter(), self.read_wait_time, self.bytes_read
+        try:
+            if self.binary:
+                return self._read_binary_result(commands)
+            return self._read_text_result(commands)
+        finally:
+            # everything that is read while waiting for this command counts for it, even other pipelined results
+            stats = self._stats_of(commands)
+            wait_time = self.read_wait_time - wait_before
+            stats.wait_time += wait_time
+            stats.parse_time += time.perf_counter() - start - wait_time
+            stats.bytes_received += self.bytes_read - read_before
+
+    def _read_text_result(self, commands: Command) -> Tuple[Optional[int], str]:
+        line = self._read_line()
+        while not line.startswith("#result"):
+            if line.startswith("#progress "):
+                progress_parts = line[len("#progress "):].split(" ", 2)
+                self._show_progress(int(progress_parts[0]), int(progress_parts[1]), progress_parts[2])
+            elif line.startswith("#error@"):
+                # error of a pipelined command: "#error@<request id> <message>"
+                request_id_str, _space, message = line[len("#error@"):].partition(" ")
+                self._fail_pending(int(request_id_str), message)
+                return int(request_id_str), ""
+            else:
+                if "Unknown command" in line or line.startswith("#error "):
+                    raise Exception(f"LAST COMMAND FAILED: {_describe(commands)} | Error message: {line}")
+                if len(line) > 0:
+                    print("[G] " + line)
+                    sys.stdout.flush()
+            line = self._read_line()
+        if not line.startswith("#result@"):
+            return None, line[len("#result"):].lstrip()
+        # pipelined result: "#result@<request id> <content>"
+        request_id_str, _space, result = line[len("#result@"):].partition(" ")
+        request_id = int(request_id_str)
+        self._resolve_pending(request_id, result)
+        return request_id, result
+
+    def _read_binary_result(self, commands: Command) -> Tuple[Optional[int], List[Any]]:
+        while True:
+            kind, *values = self._read_frame()
+            if kind == "#result":
+                request_id, *result = values
+                if request_id < 0:
+                    return None, result
+                self._resolve_pending(request_id, result)
+                return request_id, result
+            elif kind == "#progress":
+                self._show_progress(*values)
+            elif kind == "#error":
+                if len(values) > 1:  # of a pipelined command, with its request id
+                    self._fail_pending(values[1], values[0])
+                    return values[1], []
+                raise Exception(f"LAST COMMAND FAILED: {_describe(commands)} | Error message: {values[0]}")
+            else:
+                print("[G] " + " ".join(to_text_parts(values)))
+                sys.stdout.flush()
+
+    def _fail_pending(self, request_id: int, message: str):
+        future = self.pending_requests.pop(request_id)
+        self.in_flight_bytes -= future.size
+        if not future.log_errors:
+            raise Exception(f"LAST COMMAND FAILED: {_describe(future.commands)} | Error message: {message}")
+        print(f"[G] Ignoring failed {_describe(future.commands)}: {message}")
+        sys.stdout.flush()
+        future._resolve("" if not self.binary else [])
+
+    def _resolve_pending(self, request_id: int, result: Union[str, List[Any]]):
+        future = self.pending_requests.pop(request_id)
+        self.in_flight_bytes -= future.size
+        future._resolve(result)
+        self._stats_of(future.commands).add_latency(time.perf_counter() - future.submit_time)
+
+    def _read_frame(self) -> List[Any]:
+        (length,) = UINT32.unpack(self._read_bytes(4))
+        return decode_frame(self._read_bytes(length))
+
+    def _read_bytes(self, amount: int) -> bytes:
+        start = time.perf_counter()
+        data = self.process.stdout.read(amount)
+        self.read_wait_time += time.perf_counter() - start
+        self.bytes_read += len(data)
+        if len(data) < amount:
+            self._check_terminated()
+            raise Exception("Coupling Graph Subprocess closed its output!")
+        return data
 
     def _read_line(self):
-        line = self.process.stdout.readline().decode("utf-8").rstrip()
+        start = time.perf_counter()
+        raw_line = self.process.stdout.readline()
+        self.read_wait_time += time.perf_counter() - start
+        self.bytes_read += len(raw_line)
+        line = raw_line.decode("utf-8").rstrip()
         if len(line) == 0:
-            self.process.poll()
-            if self.process.returncode is not None:
-                if self.process.returncode < 0:
-                    raise Exception("Coupling Graph Subprocess was terminated with POSIX signal " + str(-self.process.returncode) + "!")
-                else:
-                    raise Exception("Coupling Graph Subprocess terminated with " + str(self.process.returncode) + "!")
+            self._check_terminated()
         return line
 
+    def _check_terminated(self):
+        self.process.poll()
+        if self.process.returncode is not None:
+            if self.process.returncode < 0:
+                raise Exception("Coupling Graph Subprocess was terminated with POSIX signal " + str(-self.process.returncode) + "!")
+            else:
+                raise Exception("Coupling Graph Subprocess terminated with " + str(self.process.returncode) + "!")
+
     def _show_progress(self, progress, total, description):
         if description != self.progress_name and self.current_progress_bar is not None:
             self.current_progress_bar.close()
@@ -98,15 +583,263 @@ class GraphManager:
         self.execute_string(["echo", "foo"])
 
 
-graph_manager = GraphManager()
+def _is_id_array(values) -> bool:
+    return isinstance(values, np.ndarray) and values.dtype.kind in "iu"
+
+
+def _describe(commands: Command) -> str:
+    return "|".join(to_text_parts(commands))
+
+
+def _estimated_size(commands: Command) -> int:
+    """upper bound of the bytes that the commands take in either protocol, ignoring the request id tag"""
+    size = 8
+    for value in commands[1:] if commands[0].startswith("@") else commands:
+        if isinstance(value, str):
+            size += 5 + 4 * len(value)  # at most four utf-8 bytes per character
+        elif isinstance(value, np.ndarray):
+            size += 5 + 25 * value.size  # longest text representation of an int32 or float64 element, with separator
+        elif isinstance(value, (list, tuple)):
+            size += 5 + sum(5 + 4 * len(str(v)) for v in value)
+        else:
+            size += 25
+    return size
+
+
+class GraphFuture(Generic[T]):
+    """the pending result of a pipelined command, see GraphManager.submit"""
+
+    def __init__(self, manager: GraphManager, commands: Command, convert: Callable[[str], T], log_errors: bool = False):
+        self.manager = manager
+        self.commands = commands
+        self.convert = convert
+        self.log_errors = log_errors  # instead of raising them, for releases
+        self.size = 0  # estimated bytes, while it is in flight
+        self.submit_time = time.perf_counter()
+        self._done = False
+        self._result: Optional[T] = None
+
+    def done(self) -> bool:
+        return self._done
+
+    def result(self) -> T:
+        while not self._done:
+            # results arrive in the order the commands were sent, so this reads at most up to our own one
+            self.manager._read_pending_result(self)
+        return self._result
+
+    def _resolve(self, raw_result: Union[str, List[Any]]):
+        self._result = self.convert(self.manager._result_to_string(raw_result))
+        self._done = True
+
+
+class InProcessGraphManager(GraphManager):
+    """drop-in replacement for the GraphManager, executing all commands within this python process"""
+
+    def __init__(self):
+        from graph_backend import GraphBackend  # only needs scipy if this backend is actually used
+        self.backend = GraphBackend()
+        self.binary = True  # results are typed values, just like in the binary protocol
+        self.capabilities = set(self.backend.handlers)
+        self._init_recording(self._init_fields(None))  # no journal, as nothing could crash separately
+
+    def execute_void(self, commands: Command) -> None:
+        self._record("v", commands)
+        self._run(commands)
+
+    def _execute(self, commands: Command) -> List[Any]:
+        self._record("r", commands)
+        return self._run(commands)
+
+    def _run(self, commands: Command) -> List[Any]:
+        self.send_releases()
+        if LOG_COMMANDS:
+            print("[CG] " + _describe(commands))
+        start = time.perf_counter()
+        result = self.backend.execute(commands)
+        # nothing is sent or parsed, so only the count and latency are meaningful
+        stats = self._stats_of(commands)
+        stats.count += 1
+        stats.add_latency(time.perf_counter() - start)
+        self._dump_stats_periodically()
+        return result
+
+    def submit(self, commands: Command, convert: Callable[[str], T] = str) -> GraphFuture[T]:
+        future = GraphFuture(self, commands, convert)
+        future._resolve(self._execute(commands))
+        return future
+
+    def send_release(self, commands: Command):
+        try:
+            self.execute_void(commands)
+        except Exception as e:
+            print(f"[G] Ignoring failed {_describe(commands)}: {e}")
+
+    def flush(self):
+        pass
+
+
+class NodeSet:
+    """handle of a node set in a graph process, which is released once this is garbage collected or released explicitly"""
+    handle_kind = "nodeSet"
+
+    def __init__(self, manager: GraphManager, node_set_id: int):
+        self.manager = manager
+        self.id = node_set_id
+        self._release_command = ["releaseNodeSet", node_set_id]
+        self._finalizer = weakref.finalize(self, manager.release_later, self._release_command)
+        self._finalizer.atexit = False  # the graph process ends anyway
+        manager.handles.add(self)
+
+    def _remap(self, new_id: int):
+        """the graph process was restarted, and this node set got a new id"""
+        self.id = new_id
+        self._release_command[1] = new_id
+
+    def __int__(self):
+        return self.id
+
+    def __index__(self):
+        return self.id
+
+    def __str__(self):
+        return str(self.id)
+
+    def __enter__(self) -> 'NodeSet':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def nodes(self) -> List[str]:
+        return self.manager.get_node_set(self.id)
+
+    def release(self):
+        if self._finalizer.detach() is not None:
+            self.manager.send_release(["releaseNodeSet", self.id])
+
+
+class PredictionTests:
+    """registered (missing node, other nodes) tests: the others of test i are other_nodes[offsets[i]:offsets[i + 1]]"""
+
+    def __init__(self, manager: GraphManager, missing_nodes: np.ndarray, offsets: np.ndarray, other_nodes: np.ndarray):
+        self.manager = manager
+        self.missing_nodes = missing_nodes
+        self.offsets = offsets
+        self.other_nodes = other_nodes
+
+    def __len__(self):
+        return len(self.missing_nodes)
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """(missing node id, other node ids) of each test"""
+        for i in range(len(self)):
+            yield int(self.missing_nodes[i]), self.other_nodes[self.offsets[i]:self.offsets[i + 1]]
+
+    def batches(self) -> Generator[Tuple[int, int, Command], None, None]:
+        """start, end and command arguments of the tests, split so that each command has about BULK_BATCH_SIZE nodes at most"""
+        start = 0
+        while start < len(self):
+            end = max(start + 1, int(np.searchsorted(self.offsets, self.offsets[start] + BULK_BATCH_SIZE, side="right")) - 1)
+            end = min(end, len(self))
+            yield start, end, [end - start, self.missing_nodes[start:end], self.offsets[start:end + 1] - self.offsets[start],
+                   self.other_nodes[self.offsets[start]:self.offsets[end]]]
+            start = end
+
+
+def _create_graph_manager() -> GraphManager:
+    return InProcessGraphManager() if GRAPH_BACKEND == "python" else GraphManager()
+
+
+class GraphManagerPool:
+    """graph managers, each with its own graph process, that are started on first use. Graphs of one repo always live in the same one"""
+
+    def __init__(self, size: int = GRAPH_PROCESSES):
+        self.managers: List[Optional[GraphManager]] = [None] * max(1, size)
+        self.lock = threading.Lock()
+
+    def get(self, index: int) -> GraphManager:
+        if self.managers[index] is None:
+            with self.lock:
+                if self.managers[index] is None:
+                    self.managers[index] = _create_graph_manager()
+        return self.managers[index]
+
+    def for_repo(self, repo_name: str) -> GraphManager:
+        # crc32 instead of hash(), so that the sharding is the same in every python process
+        return self.get(zlib.crc32(repo_name.encode("utf-8")) % len(self.managers))
+
+    def use_only(self, manager: GraphManager):
+        """let all repos share this manager, for clients that address graphs by their id only"""
+        with self.lock:
+            self.managers = [manager]
+
+    def started_managers(self) -> List[GraphManager]:
+        return [m for m in self.managers if m is not None]
+
+    def flush(self):
+        for manager in self.started_managers():
+            manager.flush()
+
+
+graph_managers = GraphManagerPool()
+graph_manager = graph_managers.get(0)  # default manager, for graphs and node sets that do not belong to a repo
+EXPORT_DIRECTORY = os.getenv("COUPLING_GRAPH_EXPORT_DIRECTORY", "/dev/shm" if os.path.isdir("/dev/shm") else None)  # None: system temp dir
+TRANSFER_REPO_NAME = "_transfer"  # repo name under which graphs are saved when copying them between graph processes
+
+
+def _mutating(method):
+    """for methods that change the graph: outdates python side caches and copies of it"""
+    @wraps(method)
+    def wrapper(self: 'CouplingGraph', *args, **kwargs):
+        self.version += 1
+        self.copies.clear()
+        return method(self, *args, **kwargs)
+    return wrapper
 
 
 class CouplingGraph:
-    def __init__(self, creation_cmd_or_id: Union[int, List[str]]):
+    handle_kind = "graph"
+
+    def __init__(self, creation_cmd_or_id: Union[int, Command], manager: Optional[GraphManager] = None):
+        self.manager = graph_manager if manager is None else manager
+        self.version = 0  # incremented by every _mutating method
+        self.copies: Dict[int, CouplingGraph] = {}  # copies of this graph in other graph managers, by manager id
+        self.copied_version: Optional[Tuple[int, ...]] = None  # state_version of the source graph, if this is a copy
+        self._finalizer: Optional[weakref.finalize] = None
+        self._release_command = ["releaseGraph", None]
         if isinstance(creation_cmd_or_id, int):
             self.id = creation_cmd_or_id
         else:
-            self.id = graph_manager.execute_int(creation_cmd_or_id)
+            self.id = self.manager.execute_int(creation_cmd_or_id)
+            self._own()
+        self._release_command[1] = self.id
+        self.manager.handles.add(self)
+
+    def _own(self):
+        """release the graph in the graph process once this handle is garbage collected"""
+        self._finalizer = weakref.finalize(self, self.manager.release_later, self._release_command)
+        self._finalizer.atexit = False  # the graph process ends anyway
+
+    def _remap(self, new_id: int):
+        """the graph process was restarted, and this graph got a new id"""
+        self.id = new_id
+        self._release_command[1] = new_id
+
+    def release(self):
+        """free the graph in the graph process, this handle (and graphs created from it) must not be used afterwards"""
+        for copy in self.copies.values():
+            copy.release()
+        self.copies.clear()
+        if self._finalizer is None or self._finalizer.detach() is not None:
+            self.manager.send_release(["releaseGraph", self.id])
+        self._finalizer = None
+
+    def __enter__(self) -> 'CouplingGraph':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
 
     @property
     def name(self):
@@ -124,28 +857,173 @@ class CouplingGraph:
     def get_normalized_coupling(self, a: str, b: str) -> float:
         return self._exec_float("getNormalizedCoupling", [a, b])
 
-    def save(self, repo_name: str) -> None:
-        self._exec_void("save", [repo_name, METRICS_SAVE_PATH])
+    def submit_normalized_support(self, node: str) -> GraphFuture[float]:
+        return self._submit("getNormalizedSupport", [node], float)
+
+    def submit_normalized_coupling(self, a: str, b: str) -> GraphFuture[float]:
+        return self._submit("getNormalizedCoupling", [a, b], float)
+
+    def get_normalized_couplings(self, a: Union[Sequence[str], Sequence[Tuple[str, str]], np.ndarray], b: Union[Sequence[str], np.ndarray, None] = None,
+                                 nodes: Optional[Sequence[str]] = None) -> np.ndarray:
+        """couplings of many node pairs in one go, see get_normalized_couplings_of_graphs for the parameters"""
+        return get_normalized_couplings_of_graphs([self], a, b, nodes)[:, 0]
+
+    def save(self, repo_name: str, path: str = METRICS_SAVE_PATH) -> None:
+        self._exec_void("save", [repo_name, path])
 
     @staticmethod
-    def load(repo_name: str, name: str, cls=None) -> 'CouplingGraph':
+    def load(repo_name: str, name: str, cls=None, manager: Optional[GraphManager] = None, path: str = METRICS_SAVE_PATH) -> 'CouplingGraph':
         if cls is None:
             cls = CouplingGraph
-        return cls(graph_manager.execute_int(["load", repo_name, name, METRICS_SAVE_PATH]))
+        if manager is None:
+            manager = graph_managers.for_repo(repo_name)
+        graph = cls(manager.execute_int(["load", repo_name, name, path]), manager)
+        graph._own()
+        return graph
 
     @staticmethod
-    def pickle_path(repo_name, name):
-        return graph_manager.execute_string(["getSaveLocation", repo_name, name, METRICS_SAVE_PATH])
+    def pickle_path(repo_name, name, path: str = METRICS_SAVE_PATH):
+        return graph_manager.execute_string(["getSaveLocation", repo_name, name, path])
+
+    def state_version(self) -> Tuple[int, ...]:
+        """changes whenever the coupling values of this graph might have changed"""
+        return self.version,
+
+    def on_manager(self, manager: GraphManager) -> 'CouplingGraph':
+        """this graph, or a snapshot copy of it that lives in the given graph manager, copied again once this graph changed"""
+        if manager is self.manager:
+            return self
+        copy = self.copies.get(id(manager))
+        version = self.state_version()
+        if copy is None or copy.copied_version != version:
+            # the outdated copy is released once nothing (like a combination using it) references it anymore
+            copy = self._copy_to(manager)
+            copy.copied_version = version
+            self.copies[id(manager)] = copy
+        return copy
+
+    def _refresh_inputs(self):
+        """for graphs built from copies of other graphs: re-create this graph if any of them is outdated, see on_manager"""
+        pass
 
-    def how_well_predicts_missing_node(self, node_set: List[str], node_missing_from_set: str, all_nodes_id: int) -> float:
-        return self._exec_float("howWellPredictsMissingNode", [str(all_nodes_id), node_missing_from_set] + node_set)
+    def _recreate(self, creation_cmd: Command):
+        old_id = self.id
+        self._remap(self.manager.execute_int(creation_cmd))
+        self.manager.send_release(["releaseGraph", old_id])
+
+    def _copy_to(self, manager: GraphManager) -> 'CouplingGraph':
+        with tempfile.TemporaryDirectory() as path:
+            path += "/"
+            self._exec_void("save", [TRANSFER_REPO_NAME, path])
+            copy = type(self)(manager.execute_int(["load", TRANSFER_REPO_NAME, self.name, path]), manager)
+            copy._own()
+            return copy
+
+    def how_well_predicts_missing_node(self, node_set: Union[List[str], np.ndarray], node_missing_from_set: Union[str, int], all_nodes_id: Union[int, NodeSet]) -> float:
+        """nodes either by name or by registered node id"""
+        if not self.manager.supports("howWellPredictsMissingNodeIds"):
+            if _is_id_array(node_set):
+                node_set = self.manager.node_names_of(node_set)
+            if not isinstance(node_missing_from_set, str):
+                node_missing_from_set = self.manager.node_names_of([node_missing_from_set])[0]
+            return self._exec_float("howWellPredictsMissingNode", [int(all_nodes_id), node_missing_from_set, list(node_set)])
+        if not _is_id_array(node_set):
+            node_set = self.manager.register_nodes(node_set)
+        if isinstance(node_missing_from_set, str):
+            node_missing_from_set = self.manager.register_nodes([node_missing_from_set])[0]
+        return self._exec_float("howWellPredictsMissingNodeIds", [int(all_nodes_id), int(node_missing_from_set), node_set])
+
+    def how_well_predicts_missing_nodes(self, tests: Union[Sequence[Tuple[str, Sequence[str]]], PredictionTests], all_nodes_id: Union[int, NodeSet]) -> np.ndarray:
+        """how_well_predicts_missing_node for each (missing node, other nodes) test, in one command per batch of tests"""
+        if not isinstance(tests, PredictionTests):
+            tests = self.manager.register_prediction_tests(tests)
+        if not self.manager.supports("howWellPredictsMissingNodesIds"):
+            return np.array([self.how_well_predicts_missing_node(others, missing, all_nodes_id) for missing, others in tests], dtype=np.float64)
+        result = np.zeros(len(tests))
+        for start, end, batch in tests.batches():
+            values = self._exec_values("howWellPredictsMissingNodesIds", [int(all_nodes_id)] + batch)
+            result[start:end] = np.asarray(values[0] if self.manager.binary else values, dtype=np.float64)
+        return result
+
+    def top_k_neighbors(self, node: str, k: int) -> List[Tuple[str, float]]:
+        """the (at most) k nodes with the highest positive coupling to the given one, highest first"""
+        return self.top_k_neighbors_many([node], k)[0]
+
+    def top_k_neighbors_many(self, nodes: Union[Sequence[str], np.ndarray], k: int) -> List[List[Tuple[str, float]]]:
+        """top_k_neighbors of each node (by name or registered node id), with one command per batch of nodes"""
+        if not self.manager.supports("getTopNeighborsIds"):
+            return self._top_k_neighbors_of_couplings(nodes, k)
+        if not _is_id_array(nodes):
+            nodes = self.manager.register_nodes(nodes)
+        result = []
+        batch_size = max(1, BULK_BATCH_SIZE // max(1, k))
+        for start in range(0, len(nodes), batch_size):
+            batch = nodes[start:start + batch_size]
+            values = self._exec_values("getTopNeighborsIds", [k, batch])
+            if self.manager.binary:
+                counts, names, couplings = values
+            else:
+                counts = [int(c) for c in values[:len(batch)]]
+                names = values[len(batch):len(batch) + sum(counts)]
+                couplings = values[len(batch) + sum(counts):]
+            position = 0
+            for count in counts:
+                result.append([(names[i], float(couplings[i])) for i in range(position, position + count)])
+                position += count
+        return result
+
+    def _top_k_neighbors_of_couplings(self, nodes: Union[Sequence[str], np.ndarray], k: int) -> List[List[Tuple[str, float]]]:
+        """top_k_neighbors_many for the original c++ executable, ranking the couplings to all nodes of this graph"""
+        candidates = self.get_node_set()
+        if candidates is None:
+            raise Exception("Cannot find the neighbors of nodes in a graph without a node set!")
+        candidates = sorted(candidates)
+        if _is_id_array(nodes):
+            nodes = self.manager.node_names_of(nodes)
+        result = []
+        for node in nodes:
+            couplings = self.get_normalized_couplings([node] * len(candidates), candidates)
+            ranking = sorted((i for i in np.flatnonzero(couplings > 0) if candidates[i] != node), key=lambda i: -couplings[i])
+            result.append([(candidates[i], float(couplings[i])) for i in ranking[:k]])
+        return result
+
+    def matrix(self, node_set_id: Union[int, NodeSet], dense: bool = False) -> Union['scipy.sparse.csr_matrix', np.ndarray]:
+        """
+        all couplings between the nodes of the node set, in its order, computed in one command.
+        A symmetric scipy sparse matrix for sparse graphs (like explicit ones), a dense float32 matrix otherwise or if dense is set
+        """
+        if not self.manager.supports("getCouplingMatrix"):
+            return self._matrix_of_couplings(node_set_id)
+        values = self._exec_values("getCouplingMatrix", [int(node_set_id), int(dense)])
+        n = int(values[1])
+        if values[0] == "dense":
+            return np.asarray(values[2] if self.manager.binary else values[2:], dtype=np.float32).reshape((n, n))
+        import scipy.sparse  # only needed for sparse results
+        if self.manager.binary:
+            rows, columns, data = values[3:6]
+        else:
+            count = int(values[2])
+            rows, columns, data = values[3:3 + count], values[3 + count:3 + 2 * count], values[3 + 2 * count:]
+        upper = scipy.sparse.csr_matrix((np.asarray(data, dtype=np.float32), (np.asarray(rows, dtype=np.int32), np.asarray(columns, dtype=np.int32))), shape=(n, n))
+        return (upper + upper.T).tocsr()
+
+    def _matrix_of_couplings(self, node_set_id: Union[int, NodeSet]) -> np.ndarray:
+        """matrix for the original c++ executable: always dense, with the couplings of all node pairs, a batch of rows at a time"""
+        node_ids = self.manager.register_nodes(self.manager.get_node_set(node_set_id))
+        n = len(node_ids)
+        result = np.empty((n, n), dtype=np.float32)
+        rows_per_batch = max(1, BULK_BATCH_SIZE // max(1, n))
+        for start in range(0, n, rows_per_batch):
+            rows = node_ids[start:start + rows_per_batch]
+            result[start:start + len(rows)] = self.get_normalized_couplings(np.repeat(rows, n), np.tile(node_ids, len(rows))).reshape((len(rows), n))
+        return result
 
     def print_statistics(self):
         self._exec_void("printStatistics")
         self._flush()
 
     def get_most_linked_node_pairs(self, amount: int) -> List[Tuple[float, str, str]]:
-        return [(float(w), a, b) for w, a, b in (p.split(";") for p in self._exec_strings("getMostLinkedNodePairs", [str(amount)]))]
+        return [(float(w), a, b) for w, a, b in (p.split(";") for p in self._exec_strings("getMostLinkedNodePairs", [amount]))]
 
     def print_most_linked_nodes(self, amount=10):
         print("Most linked nodes:")
@@ -153,61 +1031,154 @@ class CouplingGraph:
         for w, a, b in debug_list[0:amount]:
             print(str(w) + ": " + a + " <> " + b)
 
-    def _exec_void(self, cmd: str, other_args: List[str] = []) -> None:
-        graph_manager.execute_void([cmd, str(self.id)] + other_args)
+    def _command(self, cmd: str, other_args: Command) -> Command:
+        self._refresh_inputs()
+        return [cmd, self.id] + other_args
+
+    def _exec_void(self, cmd: str, other_args: Command = []) -> None:
+        self.manager.execute_void(self._command(cmd, other_args))
 
-    def _exec_int(self, cmd: str, other_args: List[str] = []) -> int:
-        return graph_manager.execute_int([cmd, str(self.id)] + other_args)
+    def _exec_int(self, cmd: str, other_args: Command = []) -> int:
+        return self.manager.execute_int(self._command(cmd, other_args))
 
-    def _exec_float(self, cmd: str, other_args: List[str] = []) -> float:
-        return graph_manager.execute_float([cmd, str(self.id)] + other_args)
+    def _exec_float(self, cmd: str, other_args: Command = []) -> float:
+        return self.manager.execute_float(self._command(cmd, other_args))
 
-    def _exec_string(self, cmd: str, other_args: List[str] = []) -> str:
-        return graph_manager.execute_string([cmd, str(self.id)] + other_args)
+    def _exec_string(self, cmd: str, other_args: Command = []) -> str:
+        return self.manager.execute_string(self._command(cmd, other_args))
 
-    def _exec_strings(self, cmd: str, other_args: List[str] = []) -> List[str]:
-        return graph_manager.execute_strings([cmd, str(self.id)] + other_args)
+    def _exec_strings(self, cmd: str, other_args: Command = []) -> List[str]:
+        return self.manager.execute_strings(self._command(cmd, other_args))
 
-    def _exec_ints(self, cmd: str, other_args: List[str] = []) -> List[int]:
+    def _exec_values(self, cmd: str, other_args: Command = []) -> List[Any]:
+        return self.manager.execute_values(self._command(cmd, other_args))
+
+    def _exec_ints(self, cmd: str, other_args: Command = []) -> List[int]:
         return [int(v) for v in self._exec_strings(cmd, other_args)]
 
+    def _submit(self, cmd: str, other_args: Command = [], convert: Callable[[str], T] = str) -> GraphFuture[T]:
+        return self.manager.submit(self._command(cmd, other_args), convert)
+
     def _flush(self):
-        graph_manager.flush()
+        self.manager.flush()
+
+
+def get_normalized_couplings_of_graphs(graphs: List[CouplingGraph], a: Union[Sequence[str], Sequence[Tuple[str, str]], np.ndarray],
+                                       b: Union[Sequence[str], np.ndarray, None] = None, nodes: Optional[Sequence[str]] = None) -> np.ndarray:
+    """
+    matrix of couplings, one row per node pair and one column per graph.
+    The pairs are either given as a list of (a, b) tuples, or as two parallel lists a and b.
+    If nodes is given, a and b are index arrays into that list of nodes, otherwise integer arrays are registered node ids.
+    """
+    manager = graphs[0].manager
+    if b is None:
+        a, b = ([pair[i] for pair in a] for i in range(2))
+    if nodes is not None:
+        node_ids = manager.register_nodes(nodes)
+        a, b = node_ids[np.asarray(a, dtype=np.int64)], node_ids[np.asarray(b, dtype=np.int64)]
+    if not _is_id_array(a):
+        a = manager.register_nodes(a)
+    if not _is_id_array(b):
+        b = manager.register_nodes(b)
+    if len(a) != len(b):
+        raise Exception(f"Got {len(a)} first nodes, but {len(b)} second nodes!")
+    graph_ids = np.array([g.on_manager(manager).id for g in graphs])
+    if not manager.supports("getNormalizedCouplingsIds"):
+        # one command per pair and graph, for the original c++ executable
+        commands = [["getNormalizedCoupling", int(graph_id), x, y] for x, y in zip(manager.node_names_of(a), manager.node_names_of(b)) for graph_id in graph_ids]
+        return np.array(manager.execute_pipelined(commands, float), dtype=np.float64).reshape((len(a), len(graphs)))
+    result = np.empty((len(a), len(graphs)))
+    for start in range(0, len(a), BULK_BATCH_SIZE):
+        end = min(start + BULK_BATCH_SIZE, len(a))
+        # result: the couplings of all pairs, for each pair the values of all graphs
+        values = manager.execute_values(["getNormalizedCouplingsIds", len(graphs), graph_ids, end - start, a[start:end], b[start:end]])
+        result[start:end] = np.asarray(values[0] if manager.binary else values, dtype=np.float64).reshape((end - start, len(graphs)))
+    return result
 
 
 class ExplicitCouplingGraph(CouplingGraph):
-    def __init__(self, name_or_id: Union[int, str]):
+    def __init__(self, name_or_id: Union[int, str], manager: Optional[GraphManager] = None):
         if isinstance(name_or_id, int):
-            CouplingGraph.__init__(self, name_or_id)
+            CouplingGraph.__init__(self, name_or_id, manager)
         else:
-            CouplingGraph.__init__(self, ["createExplicit", name_or_id])
+            CouplingGraph.__init__(self, ["createExplicit", name_or_id], manager)
 
+    @_mutating
     def add(self, a: str, b: str, delta: float):
-        self._exec_void("explicitAdd", [a, b, str(delta)])
+        self._exec_void("explicitAdd", [a, b, delta])
 
+    @_mutating
     def add_support(self, node: str, delta: float):
-        self._exec_void("explicitAddSupport", [node, str(delta)])
+        self._exec_void("explicitAddSupport", [node, delta])
 
+    @_mutating
     def add_and_support(self, a: str, b: str, delta: float):
-        self._exec_void("explicitAddAndSupport", [a, b, str(delta)])
-
+        self._exec_void("explicitAddAndSupport", [a, b, delta])
+
+    @_mutating
+    def add_many(self, edges: Iterable[Tuple[str, str, float]]):
+        """same as calling add for each (a, b, delta) edge, but with only one command per batch of distinct node pairs"""
+        self._exec_bulk_edges("explicitAddManyIds", "explicitAdd", edges)
+
+    @_mutating
+    def add_support_many(self, supports: Iterable[Tuple[str, float]]):
+        """same as calling add_support for each (node, delta), but with only one command per batch of distinct nodes"""
+        for batch in _aggregated_batches(((node,), delta) for node, delta in supports):
+            if not self.manager.supports("explicitAddSupportManyIds"):
+                for (node,), delta in batch:
+                    self._exec_void("explicitAddSupport", [node, delta])
+                continue
+            nodes = self.manager.register_nodes([node for (node,), _delta in batch])
+            self._exec_void("explicitAddSupportManyIds", [len(batch), nodes, np.array([delta for _key, delta in batch])])
+
+    @_mutating
+    def add_and_support_many(self, edges: Iterable[Tuple[str, str, float]]):
+        """same as calling add_and_support for each (a, b, delta) edge, but with only one command per batch of distinct node pairs"""
+        self._exec_bulk_edges("explicitAddAndSupportManyIds", "explicitAddAndSupport", edges)
+
+    def _exec_bulk_edges(self, cmd: str, single_cmd: str, edges: Iterable[Tuple[str, str, float]]):
+        # bulk format: count, then all first node ids, then all second node ids, then all deltas
+        for batch in _aggregated_batches(((a, b), delta) for a, b, delta in edges):
+            if not self.manager.supports(cmd):
+                for (a, b), delta in batch:  # still only one command per distinct node pair
+                    self._exec_void(single_cmd, [a, b, delta])
+                continue
+            a_ids = self.manager.register_nodes([a for (a, _b), _delta in batch])
+            b_ids = self.manager.register_nodes([b for (_a, b), _delta in batch])
+            self._exec_void(cmd, [len(batch), a_ids, b_ids, np.array([delta for _key, delta in batch])])
+
+    @_mutating
     def cutoff_edges(self, minimum_weight: float):
-        self._exec_void("explicitCutoffEdges", [str(minimum_weight)])
+        self._exec_void("explicitCutoffEdges", [minimum_weight])
         self._flush()
 
+    @_mutating
     def remove_small_components(self, minimum_component_size: int):
-        self._exec_void("explicitRemoveSmallComponents", [str(minimum_component_size)])
+        self._exec_void("explicitRemoveSmallComponents", [minimum_component_size])
         self._flush()
 
+    @_mutating
     def propagate_down(self, layers=1, weight_factor=0.2):
-        self._exec_void("explicitPropagateDown", [str(layers), str(weight_factor)])
+        self._exec_void("explicitPropagateDown", [layers, weight_factor])
         self._flush()
 
+    @_mutating
     def dilate(self, iterations=1, weight_factor=0.2):
-        self._exec_void("explicitDilate", [str(iterations), str(weight_factor)])
+        self._exec_void("explicitDilate", [iterations, weight_factor])
         self._flush()
         
     def get_data(self) -> Tuple[List[str], List[float], List[Tuple[int, int, float]]]:
+        node_names, supports, sources, targets, weights = self.get_data_arrays()
+        return node_names, supports.tolist(), list(zip(sources.tolist(), targets.tolist(), weights.tolist()))
+
+    def get_data_arrays(self) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """node names, their supports, and all edges as arrays of source node index, target node index and weight"""
+        if self.manager.binary:
+            # binary result: format specifier, node names, supports, edge sources, edge targets, edge weights
+            type_name, node_names, supports, sources, targets, weights, *_ = self._exec_values("explicitGetData")
+            if type_name != "Explicit":
+                raise Exception("expected explicit type for getting data")
+            return node_names, supports, sources, targets, weights
         # see the c++ program for the output format specification, but it should be this:
         # line 1: format specifier (always "Explicit")
         # line 2: all node strings
@@ -216,38 +1187,141 @@ class ExplicitCouplingGraph(CouplingGraph):
         type_name, raw_node_names, raw_supports, raw_edges, *_ = self._exec_strings("explicitGetData")
         if type_name != "Explicit":
             raise Exception("expected explicit type for getting data")
-        node_names = raw_node_names.split(";")
-        supports = [float(support) for support in raw_supports.split(";")]
-        edges = [(int(n1), int(n2), float(weight)) for n1, n2, weight in (edge_data.split(",") for edge_data in raw_edges.split(";"))]
-        return node_names, supports, edges
+        node_names = raw_node_names.split(";") if len(raw_node_names) > 0 else []
+        supports = np.array(raw_supports.split(";") if len(raw_supports) > 0 else [], dtype=np.float64)
+        if len(raw_edges) == 0:
+            edges = np.zeros((0, 3))
+        else:
+            edges = np.array(raw_edges.replace(";", ",").split(","), dtype=np.float64).reshape((-1, 3))
+        return node_names, supports, edges[:, 0].astype(np.int32), edges[:, 1].astype(np.int32), edges[:, 2]
+
+    def export_data(self) -> 'ExplicitGraphData':
+        """like get_data_arrays, but the graph process writes the data into a file that is memory-mapped instead of being sent"""
+        if not self.manager.supports("explicitExportData"):
+            return ExplicitGraphData.from_arrays(*self.get_data_arrays())
+        handle, path = tempfile.mkstemp(prefix="coupling_graph_", suffix=".bin", dir=EXPORT_DIRECTORY)
+        os.close(handle)
+        try:
+            self._exec_string("explicitExportData", [path])  # waiting for it to be written completely
+            return ExplicitGraphData.read(path)
+        finally:
+            os.remove(path)  # the mapping stays valid until the arrays are garbage collected
 
     def get_connected_component_sizes(self):
         return self._exec_ints("getConnectedComponentSizes")
 
     def show_weight_histogram(self):
-        node_names, supports, edges = self.get_data()
+        data = self.export_data()
+        supports, sources, targets, edge_weights = data.supports, data.sources, data.targets, data.weights
 
-        edge_weights = [w for n1, n2, w in edges]
         show_histogram(edge_weights, 'Histogram of edge weights in coupling graph', 'Coupling Strength', 'Amount', 'b')
 
-        node_weights = [0.0 for _n in supports]
-        for n1, n2, w in edges:
-            node_weights[n1] += w
-            node_weights[n2] += w
+        node_weights = np.bincount(sources, edge_weights, len(supports)) + np.bincount(targets, edge_weights, len(supports))
         show_histogram(node_weights, 'Histogram of node weights', 'Coupling Strength', 'Amount', 'g')
 
         show_histogram(supports, 'Histogram of node support values', 'Support', 'Amount', 'g')
 
 
+# export file of explicitExportData, all little-endian:
+# header: 8 byte magic "MVMMGRF1", uint64 node count n, uint64 edge count m, uint64 byte length of all node names
+# then: float64 supports[n], uint64 name_offsets[n + 1], int32 sources[m], int32 targets[m], float32 weights[m],
+# and all utf-8 node names, each one followed by a line break. name_offsets[i] is where name i starts, name_offsets[n] is the end
+EXPORT_MAGIC = b"MVMMGRF1"
+_EXPORT_HEADER = struct.Struct("<8sQQQ")
+
+
+class ExplicitGraphData:
+    """read-only numpy views into an exported explicit graph, node names are only decoded when asked for"""
+
+    def __init__(self, supports: np.ndarray, name_offsets: np.ndarray, sources: np.ndarray, targets: np.ndarray,
+                 weights: np.ndarray, name_bytes: np.ndarray):
+        self.supports = supports
+        self.name_offsets = name_offsets
+        self.sources = sources
+        self.targets = targets
+        self.weights = weights
+        self.name_bytes = name_bytes
+
+    @staticmethod
+    def read(path: str) -> 'ExplicitGraphData':
+        with open(path, "rb") as f:
+            magic, node_count, edge_count, names_length = _EXPORT_HEADER.unpack(f.read(_EXPORT_HEADER.size))
+        if magic != EXPORT_MAGIC:
+            raise Exception(f"{path} is not a coupling graph export!")
+        offset = _EXPORT_HEADER.size
+
+        def section(dtype: str, count: int) -> np.ndarray:
+            nonlocal offset
+            if count == 0:
+                return np.zeros(0, dtype=dtype)
+            result = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+            offset += result.nbytes
+            return result
+
+        # the sections are evaluated in file order
+        return ExplicitGraphData(section("<f8", node_count), section("<u8", node_count + 1), section("<i4", edge_count),
+                                 section("<i4", edge_count), section("<f4", edge_count), section("u1", names_length))
+
+    @staticmethod
+    def from_arrays(node_names: List[str], supports: np.ndarray, sources: np.ndarray, targets: np.ndarray,
+                    weights: np.ndarray) -> 'ExplicitGraphData':
+        """the same layout as an export file, for graph processes that can only send their data"""
+        encoded = [(name + "\n").encode("utf-8") for name in node_names]
+        name_offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+        np.cumsum([len(e) for e in encoded], out=name_offsets[1:])
+        return ExplicitGraphData(np.asarray(supports, dtype="<f8"), name_offsets, np.asarray(sources, dtype="<i4"),
+                                 np.asarray(targets, dtype="<i4"), np.asarray(weights, dtype="<f4"),
+                                 np.frombuffer(b"".join(encoded), dtype="u1"))
+
+    def __len__(self):
+        return len(self.supports)
+
+    def node_name(self, index: int) -> str:
+        return self.name_bytes[self.name_offsets[index]:self.name_offsets[index + 1] - 1].tobytes().decode("utf-8")
+
+    def node_names(self) -> List[str]:
+        return self.name_bytes.tobytes().decode("utf-8").split("\n")[:len(self)]
+
+
+def _aggregated_batches(entries: Iterable[Tuple[K, float]]) -> Generator[List[Tuple[K, float]], None, None]:
+    """sum up the deltas of duplicate keys, yielding batches of at most BULK_BATCH_SIZE distinct keys"""
+    aggregated: Dict[K, float] = defaultdict(float)
+    for key, delta in entries:
+        aggregated[key] += delta
+        if len(aggregated) >= BULK_BATCH_SIZE:
+            yield list(aggregated.items())
+            aggregated.clear()
+    if len(aggregated) > 0:
+        yield list(aggregated.items())
+
+
 class SimilarityCouplingGraph(CouplingGraph):
-    def __init__(self, name_or_id: Union[int, str]):
+    def __init__(self, name_or_id: Union[int, str], manager: Optional[GraphManager] = None):
         if isinstance(name_or_id, int):
-            CouplingGraph.__init__(self, name_or_id)
+            CouplingGraph.__init__(self, name_or_id, manager)
         else:
-            CouplingGraph.__init__(self, ["createSimilarity", name_or_id])
+            CouplingGraph.__init__(self, ["createSimilarity", name_or_id], manager)
 
+    @_mutating
     def add_node(self, node: str, coordinates: List[float], support: float):
-        self._exec_void("similarityAddNode", [node] + [str(c) for c in coordinates] + [str(support)])
+        self._exec_void("similarityAddNode", [node, np.asarray(coordinates, dtype=np.float64), support])
+
+    @_mutating
+    def add_nodes(self, nodes: Sequence[str], coordinates: np.ndarray, supports: Sequence[float]):
+        """same as calling add_node for each node, with its row of the coordinates matrix, but as one binary array per batch"""
+        if len(nodes) == 0:
+            return
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape((len(nodes), -1))
+        supports = np.asarray(supports, dtype=np.float64)
+        if not self.manager.supports("similarityAddNodesIds"):
+            for node, node_coordinates, support in zip(nodes, coordinates, supports):
+                self._exec_void("similarityAddNode", [node, node_coordinates, float(support)])
+            return
+        batch_size = max(1, BULK_BATCH_SIZE // max(1, coordinates.shape[1]))
+        for start in range(0, len(nodes), batch_size):
+            end = min(start + batch_size, len(nodes))
+            node_ids = self.manager.register_nodes(nodes[start:end])
+            self._exec_void("similarityAddNodesIds", [end - start, coordinates.shape[1], node_ids, coordinates[start:end], supports[start:end]])
 
     def similarity_get_node(self, node_name: str) -> Optional[Tuple[float, List[float]]]:
         """get support and coords of node"""
@@ -256,6 +1330,35 @@ class SimilarityCouplingGraph(CouplingGraph):
             return None
         return float(result[0]), [float(c) for c in result[1:]]
 
+    def similarity_get_pairs_above(self, threshold: float) -> List[Tuple[str, str, float]]:
+        """
+        all node pairs with at least the given similarity, without comparing all pairs:
+        big graphs use an approximate nearest neighbour index in the graph process, which might miss a few of them
+        """
+        if not self.manager.supports("similarityGetPairsAbove"):
+            return self._pairs_above_of_couplings(threshold)
+        values = self._exec_values("similarityGetPairsAbove", [float(threshold)])
+        count = int(values[0])
+        if self.manager.binary:
+            a, b, similarities = values[1:4]
+        else:
+            a, b, similarities = values[1:1 + count], values[1 + count:1 + 2 * count], values[1 + 2 * count:]
+        return [(a[i], b[i], float(similarities[i])) for i in range(count)]
+
+    def _pairs_above_of_couplings(self, threshold: float) -> List[Tuple[str, str, float]]:
+        """similarity_get_pairs_above for the original c++ executable: compares all node pairs, a batch of rows at a time"""
+        nodes = sorted(self.get_node_set())
+        node_ids = self.manager.register_nodes(nodes)
+        n = len(nodes)
+        result = []
+        rows_per_batch = max(1, BULK_BATCH_SIZE // max(1, n))
+        for start in range(0, n, rows_per_batch):
+            a, b = np.nonzero(np.triu(np.ones((min(rows_per_batch, n - start), n), dtype=bool), k=start + 1))
+            similarities = self.get_normalized_couplings(node_ids[a + start], node_ids[b])
+            for i in np.flatnonzero(similarities >= threshold):
+                result.append((nodes[a[i] + start], nodes[b[i]], float(similarities[i])))
+        return result
+
     def similarity_has_node(self, node_name: str) -> bool:
         supp_coords = self.similarity_get_node(node_name)
         if supp_coords is None:
@@ -265,39 +1368,232 @@ class SimilarityCouplingGraph(CouplingGraph):
 
 
 class ModuleDistanceCouplingGraph(CouplingGraph):
-    def __init__(self, id: Optional[int] = None):
+    def __init__(self, id: Optional[int] = None, manager: Optional[GraphManager] = None):
         if id is None:
-            CouplingGraph.__init__(self, ["createModuleDistance"])
+            CouplingGraph.__init__(self, ["createModuleDistance"], manager)
         else:
-            CouplingGraph.__init__(self, id)
+            CouplingGraph.__init__(self, id, manager)
 
-    def save(self, repo_name: str):
+    def save(self, repo_name: str, path: str = METRICS_SAVE_PATH):
         pass
 
+    def _copy_to(self, manager: GraphManager) -> 'ModuleDistanceCouplingGraph':
+        return ModuleDistanceCouplingGraph(manager=manager)
+
     def get_node_set(self) -> None:
         return None
 
 
 class CachedCouplingGraph(CouplingGraph):
-    def __init__(self, wrapped_or_id: Union[int, CouplingGraph]):
+    def __init__(self, wrapped_or_id: Union[int, CouplingGraph], manager: Optional[GraphManager] = None):
+        self.input: Optional[CouplingGraph] = None  # the given graph, which might live in another manager than wrapped
+        self.wrapped: Optional[CouplingGraph] = None
         if isinstance(wrapped_or_id, int):
-            CouplingGraph.__init__(self, wrapped_or_id)
+            CouplingGraph.__init__(self, wrapped_or_id, manager)
         else:
-            CouplingGraph.__init__(self, ["createCached", str(wrapped_or_id.id)])
+            if manager is None:
+                manager = wrapped_or_id.manager
+            self.input = wrapped_or_id
+            self.wrapped = wrapped_or_id.on_manager(manager)
+            CouplingGraph.__init__(self, ["createCached", self.wrapped.id], manager)
+
+    def state_version(self) -> Tuple[int, ...]:
+        if self.input is None:
+            return CouplingGraph.state_version(self)
+        return (self.version,) + self.input.state_version()
+
+    def _refresh_inputs(self):
+        if self.input is not None and self.input.on_manager(self.manager) is not self.wrapped:
+            self.wrapped = self.input.on_manager(self.manager)
+            self._recreate(["createCached", self.wrapped.id])
+
+    def _copy_to(self, manager: GraphManager) -> 'CachedCouplingGraph':
+        if self.input is None:
+            return CouplingGraph._copy_to(self, manager)
+        return CachedCouplingGraph(self.input, manager)  # with an empty cache
 
 
 class CombinedCouplingGraph(CouplingGraph):
-    def __init__(self, graphs_or_id: Union[int, List[CouplingGraph]], weights: Optional[Sequence[float]] = None):
+    def __init__(self, graphs_or_id: Union[int, List[CouplingGraph]], weights: Optional[Sequence[float]] = None, manager: Optional[GraphManager] = None):
+        """graphs from other graph managers are copied into the manager of the first graph (or the given one)"""
+        self.inputs: Optional[List[CouplingGraph]] = None  # the given graphs, which might live in other managers than graphs
+        self.graphs: Optional[List[CouplingGraph]] = None
+        self.weights = weights
         if isinstance(graphs_or_id, int):
-            CouplingGraph.__init__(self, graphs_or_id)
+            CouplingGraph.__init__(self, graphs_or_id, manager)
         else:
-            if weights is None:
-                CouplingGraph.__init__(self, ["createCombination"] + [str(g.id) for g in graphs_or_id])
-            else:
-                CouplingGraph.__init__(self, ["createCombinationWeights"] + [str(g.id) for g in graphs_or_id] + [str(w) for w in weights])
-
+            if manager is None:
+                manager = graphs_or_id[0].manager
+            self.inputs = list(graphs_or_id)
+            self.graphs = [g.on_manager(manager) for g in graphs_or_id]
+            CouplingGraph.__init__(self, self._creation_command(), manager)
+
+    def _creation_command(self) -> Command:
+        if self.weights is None:
+            return ["createCombination", np.array([g.id for g in self.graphs])]
+        return ["createCombinationWeights", np.array([g.id for g in self.graphs]), np.array(self.weights, dtype=np.float64)]
+
+    def _refresh_inputs(self):
+        if self.inputs is None:
+            return
+        graphs = [g.on_manager(self.manager) for g in self.inputs]
+        if any(g is not old for g, old in zip(graphs, self.graphs)):
+            self.graphs = graphs
+            self._recreate(self._creation_command())
+
+    @_mutating
     def set_weights(self, new_weights: List[float]):
-        self._exec_void("combinedSetWeights", [str(w) for w in new_weights])
+        self.weights = new_weights
+        self._exec_void("combinedSetWeights", [np.array(new_weights, dtype=np.float64)])
+
+    def how_well_predicts_missing_nodes_for_weights(self, weights_list: Sequence[Sequence[float]], tests: Union[Sequence[Tuple[str, Sequence[str]]], PredictionTests],
+                                                    all_nodes_id: Union[int, NodeSet]) -> np.ndarray:
+        """
+        the how_well_predicts_missing_nodes scores of this combination with each of the given weights, as (weights x tests) matrix.
+        The current weights of this graph stay unchanged
+        """
+        if not isinstance(tests, PredictionTests):
+            tests = self.manager.register_prediction_tests(tests)
+        weights = np.array(weights_list, dtype=np.float64).reshape((len(weights_list), -1))
+        if not self.manager.supports("howWellPredictsMissingNodesWeightsIds"):
+            return self._how_well_predicts_missing_nodes_by_setting_weights(weights, tests, all_nodes_id)
+        result = np.zeros((len(weights), len(tests)))
+        for start, end, batch in tests.batches():
+            values = self._exec_values("howWellPredictsMissingNodesWeightsIds", [int(all_nodes_id), len(weights), weights] + batch)
+            result[:, start:end] = np.asarray(values[0] if self.manager.binary else values, dtype=np.float64).reshape((len(weights), end - start))
+        return result
+
+    def _how_well_predicts_missing_nodes_by_setting_weights(self, weights: np.ndarray, tests: 'PredictionTests', all_nodes_id: Union[int, NodeSet]) -> np.ndarray:
+        """for graph processes without the batched command: one weight combination after the other"""
+        original_weights = self.weights
+        try:
+            result = np.zeros((len(weights), len(tests)))
+            for i, row in enumerate(weights):
+                self.set_weights(row.tolist())
+                result[i] = self.how_well_predicts_missing_nodes(tests, all_nodes_id)
+            return result
+        finally:
+            self.set_weights(list(original_weights) if original_weights is not None else [1.0] * weights.shape[1])  # the default of createCombination
+
+    def state_version(self) -> Tuple[int, ...]:
+        if self.inputs is None:
+            return CouplingGraph.state_version(self)
+        return sum((g.state_version() for g in self.inputs), (self.version,))
+
+    def _copy_to(self, manager: GraphManager) -> 'CombinedCouplingGraph':
+        if self.inputs is None:
+            return CouplingGraph._copy_to(self, manager)
+        return CombinedCouplingGraph(self.inputs, self.weights, manager)
+
+
+class LRUCachedCouplingGraph(CouplingGraph):
+    """
+    python side cache for the coupling and support queries of any other graph, to save the round trips to the graph process.
+    All other methods are passed on to the wrapped graph. The cache is cleared whenever that graph (or one of its inputs) is changed
+    """
+
+    def __init__(self, wrapped: CouplingGraph, max_size: int = COUPLING_CACHE_SIZE):
+        self.wrapped = wrapped
+        CouplingGraph.__init__(self, wrapped.id, wrapped.manager)
+        self.max_size = max_size
+        self.values: OrderedDict[Tuple[str, ...], float] = OrderedDict()  # (node,) for supports, (a, b) for couplings
+        self.cached_version = wrapped.state_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        # only called for attributes that this object does not have itself
+        if name == "wrapped":
+            raise AttributeError(name)
+        return getattr(self.wrapped, name)
+
+    @property
+    def id(self) -> int:
+        return self.wrapped.id  # which changes when the wrapped graph is re-created, see _refresh_inputs
+
+    @id.setter
+    def id(self, value: int):
+        pass  # set by CouplingGraph.__init__ and _remap
+
+    def _command(self, cmd: str, other_args: Command) -> Command:
+        return self.wrapped._command(cmd, other_args)
+
+    def state_version(self) -> Tuple[int, ...]:
+        return self.wrapped.state_version()
+
+    def on_manager(self, manager: GraphManager) -> CouplingGraph:
+        return self.wrapped.on_manager(manager)
+
+    def release(self):
+        """only drops the cached values: the wrapped graph belongs to whoever created it"""
+        self.values.clear()
+
+    def get_normalized_support(self, node: str) -> float:
+        return self._get((node,), lambda: self.wrapped.get_normalized_support(node))
+
+    def get_normalized_coupling(self, a: str, b: str) -> float:
+        return self._get(self._coupling_key(a, b), lambda: self.wrapped.get_normalized_coupling(a, b))
+
+    def get_normalized_couplings(self, a: Union[Sequence[str], Sequence[Tuple[str, str]], np.ndarray], b: Union[Sequence[str], np.ndarray, None] = None,
+                                 nodes: Optional[Sequence[str]] = None) -> np.ndarray:
+        if b is None:
+            a, b = ([pair[i] for pair in a] for i in range(2))
+        if nodes is not None:
+            a, b = ([nodes[i] for i in indices] for indices in (a, b))
+        if _is_id_array(a) or _is_id_array(b):
+            a, b = (self.manager.node_names_of(ids) if _is_id_array(ids) else ids for ids in (a, b))
+        self._check_version()
+        keys = [self._coupling_key(x, y) for x, y in zip(a, b)]
+        result = np.array([self.values.get(key, math.nan) for key in keys])
+        missing = np.flatnonzero(np.isnan(result))
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if len(missing) > 0:
+            result[missing] = self.wrapped.get_normalized_couplings([a[i] for i in missing], [b[i] for i in missing])
+        missing_indices = set(missing.tolist())
+        for i, key in enumerate(keys):
+            if i in missing_indices:
+                self._store(key, result[i])
+            elif key in self.values:  # might have been evicted by the new values already
+                self.values.move_to_end(key)
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"size": len(self.values), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / total if total > 0 else 0.0}
+
+    def clear_cache(self):
+        self.values.clear()
+
+    @staticmethod
+    def _coupling_key(a: str, b: str) -> Tuple[str, str]:
+        return (a, b) if a <= b else (b, a)  # all coupling graphs are symmetric
+
+    def _check_version(self):
+        version = self.wrapped.state_version()
+        if version != self.cached_version:
+            self.values.clear()
+            self.cached_version = version
+
+    def _get(self, key: Tuple[str, ...], calculate: Callable[[], float]) -> float:
+        self._check_version()
+        value = self.values.get(key)
+        if value is not None:
+            self.hits += 1
+            self.values.move_to_end(key)
+            return value
+        self.misses += 1
+        value = calculate()
+        self._store(key, value)
+        return value
+
+    def _store(self, key: Tuple[str, ...], value: float):
+        self.values[key] = value
+        if len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+            self.evictions += 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,929 @@
+"""
+In-process implementation of the commands that graph.py sends to the coupling graph executable,
+built on numpy arrays and scipy sparse matrices. Select it with COUPLING_GRAPH_BACKEND=python.
+
+Normalization used by this backend:
+ - explicit graphs: coupling = edge weight / maximum edge weight, support = support / maximum support
+ - similarity graphs: coupling = cosine similarity of the topic vectors, support = support / maximum support
+ - module distance: coupling = 1 / (1 + path_module_distance), support = 1
+ - combined graphs: weighted average of the normalized values of their graphs
+"""
+import os
+import pickle
+import struct
+import sys
+from abc import ABC, abstractmethod
+from typing import *
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from util import T
+
+EXPORT_MAGIC = b"MVMMGRF1"  # see the export file format in graph.py
+MATRIX_BLOCK_SIZE = 256  # how many rows of an all-pairs coupling matrix are computed at once
+ANN_MINIMUM_NODES = 4096  # similarity graphs with less nodes are searched exhaustively instead of with the approximate index
+ANN_TREE_COUNT = 10
+ANN_LEAF_SIZE = 64
+
+
+def _flatten(commands: List[Any]) -> List[Any]:
+    """spread lists and arrays into single values, so that text and typed commands look the same to the handlers"""
+    parts = []
+    for value in commands:
+        if isinstance(value, np.ndarray):
+            parts += value.ravel().tolist()
+        elif isinstance(value, (list, tuple)):
+            parts += value
+        else:
+            parts.append(value)
+    return parts
+
+
+def _top_k_of_rows(values: np.ndarray, k: int, names: Sequence[str]) -> List[Tuple[List[str], np.ndarray]]:
+    """per row: the names of the columns with the k largest positive values, and these values, largest first"""
+    k = min(k, values.shape[1])
+    if k <= 0:
+        return [([], np.zeros(0)) for _row in values]
+    result = []
+    for row, columns in zip(values, np.argpartition(-values, k - 1, axis=1)[:, :k]):
+        columns = columns[np.argsort(-row[columns], kind="stable")]
+        columns = columns[row[columns] > 0]
+        result.append(([names[c] for c in columns], row[columns]))
+    return result
+
+
+def _without_diagonal(matrix: sp.spmatrix) -> sp.csr_matrix:
+    coo = matrix.tocoo()
+    keep = (coo.row != coo.col) & (coo.data != 0)
+    return sp.csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])), shape=coo.shape)
+
+
+class BackendGraph(ABC):
+    def __init__(self, name: str):
+        self.name = name
+
+    def node_names(self) -> List[str]:
+        return []
+
+    @abstractmethod
+    def normalized_supports(self, nodes: Sequence[str]) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def normalized_couplings(self, a: Sequence[str], b: Sequence[str]) -> np.ndarray:
+        """pairwise: the coupling of a[i] and b[i] for each i"""
+        pass
+
+    def coupling_matrix(self, rows: Sequence[str], columns: Sequence[str]) -> np.ndarray:
+        """dense: the coupling of each row node with each column node"""
+        return self.normalized_couplings(np.repeat(rows, len(columns)), np.tile(columns, len(rows))).reshape((len(rows), len(columns)))
+
+    def sparse_coupling_matrix(self, nodes: Sequence[str]) -> Optional[sp.csr_matrix]:
+        """the coupling matrix of these nodes, if this graph is sparse (no self-couplings then), otherwise None"""
+        return None
+
+    def top_neighbors(self, nodes: Sequence[str], k: int) -> List[Tuple[List[str], np.ndarray]]:
+        """per node: the (at most) k other nodes with the highest positive coupling to it, and these couplings"""
+        # brute force over all known nodes, in blocks of rows
+        all_nodes = self.node_names()
+        positions = {name: i for i, name in enumerate(all_nodes)}
+        result = []
+        for start in range(0, len(nodes), MATRIX_BLOCK_SIZE):
+            rows = nodes[start:start + MATRIX_BLOCK_SIZE]
+            couplings = self.coupling_matrix(rows, all_nodes)
+            for r, node in enumerate(rows):
+                if node in positions:
+                    couplings[r, positions[node]] = 0
+            result += _top_k_of_rows(couplings, k, all_nodes)
+        return result
+
+    def dense_coupling_matrix(self, nodes: Sequence[str]) -> np.ndarray:
+        result = np.empty((len(nodes), len(nodes)), dtype=np.float32)
+        for start in range(0, len(nodes), MATRIX_BLOCK_SIZE):
+            result[start:start + MATRIX_BLOCK_SIZE] = self.coupling_matrix(nodes[start:start + MATRIX_BLOCK_SIZE], nodes)
+        return result
+
+    def statistics(self) -> str:
+        return f"{type(self).__name__} '{self.name}': {len(self.node_names())} nodes"
+
+    def memory_usage(self) -> int:
+        """estimated bytes that belong to this graph only"""
+        return sys.getsizeof(self)
+
+
+def _list_memory_usage(values: List[Any]) -> int:
+    return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+
+
+def _matrix_memory_usage(matrix: sp.spmatrix) -> int:
+    matrix = matrix.tocsr() if not sp.isspmatrix_csr(matrix) else matrix
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+class _NodeIndex:
+    """mapping node names to consecutive indices"""
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.indices: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, nodes: Sequence[str]) -> np.ndarray:
+        result = np.empty(len(nodes), dtype=np.int64)
+        for i, node in enumerate(nodes):
+            index = self.indices.get(node)
+            if index is None:
+                index = self.indices[node] = len(self.names)
+                self.names.append(node)
+            result[i] = index
+        return result
+
+    def memory_usage(self) -> int:
+        return _list_memory_usage(self.names) + sys.getsizeof(self.indices)
+
+    def lookup(self, nodes: Sequence[str]) -> np.ndarray:
+        """-1 for unknown nodes"""
+        return np.fromiter((self.indices.get(node, -1) for node in nodes), dtype=np.int64, count=len(nodes))
+
+
+class _RandomProjectionForest:
+    """
+    approximate nearest neighbour index for cosine similarity: random projection trees, which recursively split the vectors at the
+    median of a random projection. Similar vectors likely share a leaf in at least one tree, so only the leaf mates need to be compared
+    """
+
+    def __init__(self, unit_vectors: np.ndarray, tree_count: int = ANN_TREE_COUNT, leaf_size: int = ANN_LEAF_SIZE, seed: int = 42):
+        self.unit_vectors = unit_vectors
+        n = len(unit_vectors)
+        depth = max(0, int(np.ceil(np.log2(max(1, n) / leaf_size))))
+        random = np.random.default_rng(seed)
+        # per tree: the leaf of each vector, and the vectors of each leaf in csr layout
+        self.leaf_of: List[np.ndarray] = []
+        self.leaf_starts: List[np.ndarray] = []
+        self.leaf_members: List[np.ndarray] = []
+        for _tree in range(tree_count):
+            group = np.zeros(n, dtype=np.int64)
+            for level in range(depth):
+                directions = random.standard_normal((2 ** level, unit_vectors.shape[1]))
+                projections = np.einsum("ij,ij->i", unit_vectors, directions[group])
+                order = np.lexsort((projections, group))
+                sizes = np.bincount(group, minlength=2 ** level)
+                starts = np.cumsum(sizes) - sizes
+                rank = np.empty(n, dtype=np.int64)
+                rank[order] = np.arange(n) - starts[group[order]]
+                group = group * 2 + (rank >= sizes[group] // 2)
+            members = np.argsort(group, kind="stable")
+            leaf_starts = np.zeros(2 ** depth + 1, dtype=np.int64)
+            np.cumsum(np.bincount(group, minlength=2 ** depth), out=leaf_starts[1:])
+            self.leaf_of.append(group)
+            self.leaf_starts.append(leaf_starts)
+            self.leaf_members.append(members)
+
+    def leaves(self) -> Generator[np.ndarray, None, None]:
+        for starts, members in zip(self.leaf_starts, self.leaf_members):
+            for leaf in range(len(starts) - 1):
+                yield members[starts[leaf]:starts[leaf + 1]]
+
+    def candidates(self, index: int) -> np.ndarray:
+        """all vectors that share a leaf with the given one, without itself"""
+        result = np.unique(np.concatenate([members[starts[leaf_of[index]]:starts[leaf_of[index] + 1]]
+                                           for leaf_of, starts, members in zip(self.leaf_of, self.leaf_starts, self.leaf_members)]))
+        return result[result != index]
+
+    def top_k(self, index: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """indices and similarities of the (approximately) k most similar vectors with positive similarity, most similar first"""
+        candidates = self.candidates(index)
+        similarities = self.unit_vectors[candidates] @ self.unit_vectors[index]
+        best = np.argsort(-similarities, kind="stable")[:k]
+        best = best[similarities[best] > 0]
+        return candidates[best], similarities[best]
+
+    def pairs_above(self, threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(approximately) all pairs i < j with a similarity of at least threshold: i, j and their similarities"""
+        found_a, found_b = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for members in self.leaves():
+            vectors = self.unit_vectors[members]
+            a, b = np.nonzero(np.triu(vectors @ vectors.T >= threshold, k=1))
+            found_a.append(np.minimum(members[a], members[b]))
+            found_b.append(np.maximum(members[a], members[b]))
+        n = len(self.unit_vectors)
+        pair_keys = np.unique(np.concatenate(found_a) * n + np.concatenate(found_b))
+        a, b = pair_keys // n, pair_keys % n
+        return a, b, np.einsum("ij,ij->i", self.unit_vectors[a], self.unit_vectors[b])
+
+    def memory_usage(self) -> int:
+        return sum(a.nbytes for arrays in [self.leaf_of, self.leaf_starts, self.leaf_members] for a in arrays)
+
+
+class ExplicitGraph(BackendGraph):
+    def __init__(self, name: str):
+        BackendGraph.__init__(self, name)
+        self.nodes = _NodeIndex()
+        self.supports = np.zeros(0)
+        self.matrix = sp.csr_matrix((0, 0))  # symmetric, no self-edges
+        self.pending_edges: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self.max_weight = 0.0
+        self.neighbor_index: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None  # see _neighbor_index
+
+    def node_names(self) -> List[str]:
+        return self.nodes.names
+
+    def _add_nodes(self, nodes: Sequence[str]) -> np.ndarray:
+        indices = self.nodes.add(nodes)
+        if len(self.nodes) > len(self.supports):
+            self.supports = np.concatenate([self.supports, np.zeros(len(self.nodes) - len(self.supports))])
+        return indices
+
+    def add_edges(self, a: Sequence[str], b: Sequence[str], deltas: np.ndarray):
+        a_indices, b_indices = self._add_nodes(a), self._add_nodes(b)
+        deltas = np.broadcast_to(np.asarray(deltas, dtype=np.float64), a_indices.shape)
+        keep = a_indices != b_indices
+        self.pending_edges.append((a_indices[keep], b_indices[keep], deltas[keep]))
+
+    def add_supports(self, nodes: Sequence[str], deltas: np.ndarray):
+        indices = self._add_nodes(nodes)  # before accessing self.supports, as it might grow
+        np.add.at(self.supports, indices, np.asarray(deltas, dtype=np.float64))
+
+    def get_matrix(self) -> sp.csr_matrix:
+        n = len(self.nodes)
+        if self.matrix.shape != (n, n) or len(self.pending_edges) > 0:
+            matrix = self.matrix.tocsr()
+            matrix.resize((n, n))
+            if len(self.pending_edges) > 0:
+                rows, columns, data = (np.concatenate(parts) for parts in zip(*self.pending_edges))
+                self.pending_edges.clear()
+                added = sp.csr_matrix((data, (rows, columns)), shape=(n, n))
+                matrix = matrix + added + added.T
+            self.set_matrix(matrix)
+        return self.matrix
+
+    def set_matrix(self, matrix: sp.spmatrix):
+        matrix = matrix.tocsr()
+        matrix.eliminate_zeros()
+        self.matrix = matrix
+        self.max_weight = float(matrix.data.max()) if matrix.nnz > 0 else 0.0
+        self.neighbor_index = None
+
+    def _neighbor_index(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """csr layout (row pointers, column indices, weights) of the matrix, but with each row sorted by descending weight"""
+        matrix = self.get_matrix()  # might reset the index
+        if self.neighbor_index is None:
+            rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+            order = np.lexsort((-matrix.data, rows))
+            self.neighbor_index = (matrix.indptr, matrix.indices[order], matrix.data[order])
+        return self.neighbor_index
+
+    def top_neighbors(self, nodes: Sequence[str], k: int) -> List[Tuple[List[str], np.ndarray]]:
+        indptr, indices, weights = self._neighbor_index()
+        result = []
+        for index in self.nodes.lookup(nodes):
+            if index < 0:
+                result.append(([], np.zeros(0)))
+                continue
+            start = indptr[index]
+            end = min(indptr[index + 1], start + k)
+            result.append(([self.nodes.names[i] for i in indices[start:end]], weights[start:end] / self.max_weight))
+        return result
+
+    def normalized_supports(self, nodes: Sequence[str]) -> np.ndarray:
+        indices = self.nodes.lookup(nodes)
+        result = np.zeros(len(indices))
+        max_support = self.supports.max(initial=0)
+        if max_support > 0:
+            known = indices >= 0
+            result[known] = self.supports[indices[known]] / max_support
+        return result
+
+    def normalized_couplings(self, a: Sequence[str], b: Sequence[str]) -> np.ndarray:
+        matrix = self.get_matrix()
+        a_indices, b_indices = self.nodes.lookup(a), self.nodes.lookup(b)
+        result = np.zeros(len(a_indices))
+        known = (a_indices >= 0) & (b_indices >= 0)
+        if self.max_weight > 0 and known.any():
+            result[known] = np.asarray(matrix[a_indices[known], b_indices[known]]).ravel() / self.max_weight
+        return result
+
+    def coupling_matrix(self, rows: Sequence[str], columns: Sequence[str]) -> np.ndarray:
+        matrix = self.get_matrix()
+        row_indices, column_indices = self.nodes.lookup(rows), self.nodes.lookup(columns)
+        result = np.zeros((len(row_indices), len(column_indices)))
+        known_rows, known_columns = row_indices >= 0, column_indices >= 0
+        if self.max_weight > 0 and known_rows.any() and known_columns.any():
+            block = matrix[row_indices[known_rows]][:, column_indices[known_columns]].toarray() / self.max_weight
+            result[np.ix_(known_rows, known_columns)] = block
+        return result
+
+    def sparse_coupling_matrix(self, nodes: Sequence[str]) -> Optional[sp.csr_matrix]:
+        matrix = self.get_matrix()
+        indices = self.nodes.lookup(nodes)
+        known = np.flatnonzero(indices >= 0)
+        # maps the graph's nodes to the positions of the requested nodes, dropping all others
+        selection = sp.csr_matrix((np.ones(len(known)), (indices[known], known)), shape=(matrix.shape[0], len(nodes)))
+        result = (selection.T @ matrix @ selection).tocsr()
+        return result / self.max_weight if self.max_weight > 0 else result
+
+    def cutoff_edges(self, minimum_weight: float):
+        matrix = self.get_matrix().copy()
+        matrix.data[matrix.data < minimum_weight] = 0
+        self.set_matrix(matrix)
+
+    def component_labels(self) -> np.ndarray:
+        _count, labels = connected_components(self.get_matrix(), directed=False)
+        return labels
+
+    def remove_small_components(self, minimum_component_size: int):
+        labels = self.component_labels()
+        keep = (np.bincount(labels)[labels] >= minimum_component_size).astype(np.float64)
+        self.set_matrix(sp.diags(keep) @ self.get_matrix() @ sp.diags(keep))
+        self.supports *= keep
+
+    def propagate_down(self, layers: int, weight_factor: float):
+        """couple the children of coupled nodes (nodes named "<parent path>/<child name>") with a reduced weight"""
+        matrix = self.get_matrix()
+        n = len(self.nodes)
+        parents = self.nodes.lookup([name.rpartition("/")[0] for name in self.nodes.names])
+        has_parent = parents >= 0
+        child_of = sp.csr_matrix((np.ones(has_parent.sum()), (np.flatnonzero(has_parent), parents[has_parent])), shape=(n, n))
+        layer = matrix
+        for _ in range(layers):
+            layer = _without_diagonal((child_of @ layer + layer @ child_of.T) * weight_factor)
+            matrix = matrix + layer
+        self.set_matrix(matrix)
+
+    def dilate(self, iterations: int, weight_factor: float):
+        """couple nodes that share a neighbour, with the product of both (normalized) edges as weight"""
+        for _ in range(iterations):
+            matrix = self.get_matrix()
+            if self.max_weight == 0:
+                return
+            two_steps = _without_diagonal(matrix @ matrix) * (weight_factor / self.max_weight)
+            self.set_matrix(matrix + two_steps)
+
+    def get_data(self) -> List[Any]:
+        upper = sp.triu(self.get_matrix(), k=1).tocoo()
+        return ["Explicit", self.nodes.names, self.supports, upper.row.astype(np.int32), upper.col.astype(np.int32), upper.data]
+
+    def export_data(self, path: str) -> str:
+        upper = sp.triu(self.get_matrix(), k=1).tocoo()
+        names = [(name + "\n").encode("utf-8") for name in self.nodes.names]
+        name_offsets = np.zeros(len(names) + 1, dtype="<u8")
+        np.cumsum([len(name) for name in names], out=name_offsets[1:])
+        with open(path, "wb") as f:
+            f.write(struct.pack("<8sQQQ", EXPORT_MAGIC, len(names), upper.nnz, int(name_offsets[-1])))
+            for array, dtype in [(self.supports, "<f8"), (name_offsets, "<u8"), (upper.row, "<i4"), (upper.col, "<i4"), (upper.data, "<f4")]:
+                f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+            f.write(b"".join(names))
+        return path
+
+    def most_linked_node_pairs(self, amount: int) -> List[Tuple[float, str, str]]:
+        upper = sp.triu(self.get_matrix(), k=1).tocoo()
+        best = np.argsort(-upper.data, kind="stable")[:amount]
+        return [(float(upper.data[i]), self.nodes.names[upper.row[i]], self.nodes.names[upper.col[i]]) for i in best]
+
+    def memory_usage(self) -> int:
+        pending = sum(a.nbytes + b.nbytes + d.nbytes for a, b, d in self.pending_edges)
+        return BackendGraph.memory_usage(self) + self.nodes.memory_usage() + self.supports.nbytes + _matrix_memory_usage(self.matrix) + pending
+
+    def statistics(self) -> str:
+        matrix = self.get_matrix()
+        return f"{BackendGraph.statistics(self)}, {matrix.nnz // 2} edges, maximum edge weight {self.max_weight}"
+
+
+class SimilarityGraph(BackendGraph):
+    def __init__(self, name: str):
+        BackendGraph.__init__(self, name)
+        self.nodes = _NodeIndex()
+        self.coordinates = np.zeros((0, 0))
+        self.supports = np.zeros(0)
+        self.pending_nodes: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self.unit_coordinates: Optional[np.ndarray] = None
+        self.ann_index: Optional[_RandomProjectionForest] = None
+
+    def node_names(self) -> List[str]:
+        self._consolidate()
+        return self.nodes.names
+
+    def add_nodes(self, nodes: Sequence[str], coordinates: np.ndarray, supports: np.ndarray):
+        self.pending_nodes.append((self.nodes.add(nodes), np.asarray(coordinates, dtype=np.float64), np.asarray(supports, dtype=np.float64)))
+        self.unit_coordinates = None
+        self.ann_index = None
+
+    def _consolidate(self):
+        if len(self.pending_nodes) == 0:
+            return
+        n = len(self.nodes)
+        dimensions = max([self.coordinates.shape[1]] + [c.shape[1] for _i, c, _s in self.pending_nodes])
+        coordinates = np.zeros((n, dimensions))
+        coordinates[:self.coordinates.shape[0], :self.coordinates.shape[1]] = self.coordinates
+        supports = np.zeros(n)
+        supports[:len(self.supports)] = self.supports
+        for indices, new_coordinates, new_supports in self.pending_nodes:
+            coordinates[indices, :new_coordinates.shape[1]] = new_coordinates
+            supports[indices] = new_supports
+        self.pending_nodes.clear()
+        self.coordinates, self.supports = coordinates, supports
+
+    def _unit_coordinates(self) -> np.ndarray:
+        self._consolidate()
+        if self.unit_coordinates is None:
+            lengths = np.linalg.norm(self.coordinates, axis=1, keepdims=True)
+            self.unit_coordinates = np.divide(self.coordinates, lengths, out=np.zeros_like(self.coordinates), where=lengths > 0)
+        return self.unit_coordinates
+
+    def _ann_index(self) -> Optional[_RandomProjectionForest]:
+        """built on first use, None for small graphs"""
+        units = self._unit_coordinates()
+        if self.ann_index is None and len(units) >= ANN_MINIMUM_NODES:
+            self.ann_index = _RandomProjectionForest(units)
+        return self.ann_index
+
+    def top_neighbors(self, nodes: Sequence[str], k: int) -> List[Tuple[List[str], np.ndarray]]:
+        index = self._ann_index()
+        if index is None or k >= ANN_LEAF_SIZE:  # the leaves would not provide enough candidates
+            return BackendGraph.top_neighbors(self, nodes, k)
+        result = []
+        for node_index in self.nodes.lookup(nodes):
+            if node_index < 0:
+                result.append(([], np.zeros(0)))
+                continue
+            neighbors, similarities = index.top_k(node_index, k)
+            result.append(([self.nodes.names[i] for i in neighbors], similarities))
+        return result
+
+    def pairs_above(self, threshold: float) -> Tuple[List[str], List[str], np.ndarray]:
+        """the node pairs with at least the given similarity (approximately, for big graphs): first nodes, second nodes, similarities"""
+        index = self._ann_index()
+        if index is None:
+            units = self._unit_coordinates()
+            a, b = np.nonzero(np.triu(units @ units.T >= threshold, k=1))
+            similarities = np.einsum("ij,ij->i", units[a], units[b])
+        else:
+            a, b, similarities = index.pairs_above(threshold)
+        return [self.nodes.names[i] for i in a], [self.nodes.names[i] for i in b], similarities
+
+    def get_node(self, node: str) -> List[Any]:
+        self._consolidate()
+        index = self.nodes.indices.get(node)
+        if index is None:
+            return []
+        return [float(self.supports[index]), self.coordinates[index]]
+
+    def memory_usage(self) -> int:
+        pending = sum(i.nbytes + c.nbytes + s.nbytes for i, c, s in self.pending_nodes)
+        units = 0 if self.unit_coordinates is None else self.unit_coordinates.nbytes
+        index = 0 if self.ann_index is None else self.ann_index.memory_usage()  # shares the unit coordinates
+        return BackendGraph.memory_usage(self) + self.nodes.memory_usage() + self.coordinates.nbytes + self.supports.nbytes + units + index + pending
+
+    def normalized_supports(self, nodes: Sequence[str]) -> np.ndarray:
+        self._consolidate()
+        indices = self.nodes.lookup(nodes)
+        result = np.zeros(len(indices))
+        max_support = self.supports.max(initial=0)
+        if max_support > 0:
+            known = indices >= 0
+            result[known] = self.supports[indices[known]] / max_support
+        return result
+
+    def _unit_rows(self, nodes: Sequence[str]) -> np.ndarray:
+        units = self._unit_coordinates()
+        indices = self.nodes.lookup(nodes)
+        result = np.zeros((len(indices), units.shape[1]))
+        known = indices >= 0
+        result[known] = units[indices[known]]
+        return result
+
+    def normalized_couplings(self, a: Sequence[str], b: Sequence[str]) -> np.ndarray:
+        return np.einsum("ij,ij->i", self._unit_rows(a), self._unit_rows(b))
+
+    def coupling_matrix(self, rows: Sequence[str], columns: Sequence[str]) -> np.ndarray:
+        return self._unit_rows(rows) @ self._unit_rows(columns).T
+
+
+def _path_segments(paths: Sequence[str], segment_ids: Dict[str, int], padding: int) -> Tuple[np.ndarray, np.ndarray]:
+    """matrix of segment ids for each path (padded to the longest path), and the segment counts"""
+    split_paths = [path.split("/") for path in paths]
+    lengths = np.array([len(segments) for segments in split_paths], dtype=np.int64)
+    result = np.full((len(paths), lengths.max(initial=0)), padding, dtype=np.int64)
+    for i, segments in enumerate(split_paths):
+        result[i, :len(segments)] = [segment_ids.setdefault(s, len(segment_ids)) for s in segments]
+    return result, lengths
+
+
+class ModuleDistanceGraph(BackendGraph):
+    def __init__(self):
+        BackendGraph.__init__(self, "module_distance")
+
+    def normalized_supports(self, nodes: Sequence[str]) -> np.ndarray:
+        return np.ones(len(nodes))
+
+    @staticmethod
+    def _coupling_from_distance(distance: np.ndarray) -> np.ndarray:
+        return 1 / (1 + distance)
+
+    def normalized_couplings(self, a: Sequence[str], b: Sequence[str]) -> np.ndarray:
+        segment_ids: Dict[str, int] = {}
+        a_segments, a_lengths = _path_segments(a, segment_ids, -1)
+        b_segments, b_lengths = _path_segments(b, segment_ids, -2)  # different padding, so that it never matches
+        depth = max(a_segments.shape[1], b_segments.shape[1])
+        a_segments = np.pad(a_segments, ((0, 0), (0, depth - a_segments.shape[1])), constant_values=-1)
+        b_segments = np.pad(b_segments, ((0, 0), (0, depth - b_segments.shape[1])), constant_values=-2)
+        common = np.cumprod(a_segments == b_segments, axis=1).sum(axis=1)
+        return self._coupling_from_distance(a_lengths + b_lengths - 2 * common)
+
+    def coupling_matrix(self, rows: Sequence[str], columns: Sequence[str]) -> np.ndarray:
+        segment_ids: Dict[str, int] = {}
+        row_segments, row_lengths = _path_segments(rows, segment_ids, -1)
+        column_segments, column_lengths = _path_segments(columns, segment_ids, -2)
+        depth = min(row_segments.shape[1], column_segments.shape[1])
+        row_segments, column_segments = row_segments[:, :depth], column_segments[:, :depth]
+        result = np.empty((len(rows), len(columns)))
+        for start in range(0, len(rows), MATRIX_BLOCK_SIZE):
+            end = start + MATRIX_BLOCK_SIZE
+            common = np.cumprod(row_segments[start:end, None, :] == column_segments[None, :, :], axis=2).sum(axis=2)
+            result[start:end] = self._coupling_from_distance(row_lengths[start:end, None] + column_lengths[None, :] - 2 * common)
+        return result
+
+
+class CachedGraph(BackendGraph):
+    def __init__(self, wrapped: BackendGraph):
+        BackendGraph.__init__(self, wrapped.name)
+        self.wrapped = wrapped
+        self.cache: Dict[Tuple[str, str], float] = {}
+
+    def node_names(self) -> List[str]:
+        return self.wrapped.node_names()
+
+    def normalized_supports(self, nodes: Sequence[str]) -> np.ndarray:
+        return self.wrapped.normalized_supports(nodes)
+
+    def normalized_couplings(self, a: Sequence[str], b: Sequence[str]) -> np.ndarray:
+        result = np.array([self.cache.get((x, y), np.nan) for x, y in zip(a, b)], dtype=np.float64)
+        missing = np.flatnonzero(np.isnan(result))
+        if len(missing) > 0:
+            result[missing] = self.wrapped.normalized_couplings([a[i] for i in missing], [b[i] for i in missing])
+            for i in missing:
+                self.cache[(a[i], b[i])] = result[i]
+        return result
+
+    def coupling_matrix(self, rows: Sequence[str], columns: Sequence[str]) -> np.ndarray:
+        return self.wrapped.coupling_matrix(rows, columns)
+
+    def sparse_coupling_matrix(self, nodes: Sequence[str]) -> Optional[sp.csr_matrix]:
+        return self.wrapped.sparse_coupling_matrix(nodes)
+
+    def top_neighbors(self, nodes: Sequence[str], k: int) -> List[Tuple[List[str], np.ndarray]]:
+        return self.wrapped.top_neighbors(nodes, k)
+
+    def memory_usage(self) -> int:
+        # keys are shared with the node names of the wrapped graph, mostly
+        return BackendGraph.memory_usage(self) + sys.getsizeof(self.cache) + len(self.cache) * (sys.getsizeof((0, 0)) + sys.getsizeof(0.0))
+
+
+class CombinedGraph(BackendGraph):
+    def __init__(self, graphs: List[BackendGraph], weights: Optional[Sequence[float]] = None):
+        BackendGraph.__init__(self, "combined(" + ",".join(g.name for g in graphs) + ")")
+        self.graphs = graphs
+        self.weights = np.ones(len(graphs))
+        if weights is not None:
+            self.set_weights(weights)
+
+    def set_weights(self, weights: Sequence[float]):
+        if len(weights) != len(self.graphs):
+            raise Exception(f"Expected {len(self.graphs)} weights, got {len(weights)}!")
+        self.weights = np.array(weights, dtype=np.float64)
+
+    def node_names(self) -> List[str]:
+        return sorted(set(name for g in self.graphs for name in g.node_names()))
+
+    def _combine(self, values: Callable[[BackendGraph], np.ndarray], shape) -> np.ndarray:
+        total_weight = self.weights.sum()
+        result = np.zeros(shape)
+        if total_weight == 0:
+            return result
+        for graph, weight in zip(self.graphs, self.weights):
+            if weight != 0:
+                result += values(graph) * weight
+        return result / total_weight
+
+    def normalized_supports(self, nodes: Sequence[str]) -> np.ndarray:
+        return self._combine(lambda g: g.normalized_supports(nodes), len(nodes))
+
+    def normalized_couplings(self, a: Sequence[str], b: Sequence[str]) -> np.ndarray:
+        return self._combine(lambda g: g.normalized_couplings(a, b), len(a))
+
+    def coupling_matrix(self, rows: Sequence[str], columns: Sequence[str]) -> np.ndarray:
+        return self._combine(lambda g: g.coupling_matrix(rows, columns), (len(rows), len(columns)))
+
+    def sparse_coupling_matrix(self, nodes: Sequence[str]) -> Optional[sp.csr_matrix]:
+        """sparse only if all graphs with a weight are"""
+        matrices = [g.sparse_coupling_matrix(nodes) for g, weight in zip(self.graphs, self.weights) if weight != 0]
+        if any(matrix is None for matrix in matrices):
+            return None
+        result = sp.csr_matrix((len(nodes), len(nodes)))
+        total_weight = self.weights.sum()
+        if total_weight == 0:
+            return result
+        for matrix, weight in zip(matrices, self.weights[self.weights != 0]):
+            result = result + matrix * weight
+        return (result / total_weight).tocsr()
+
+
+class GraphBackend:
+    """the graphs and node sets of one backend instance, and the handlers for all commands"""
+
+    def __init__(self):
+        self.graphs: Dict[int, BackendGraph] = {}
+        self.node_sets: Dict[int, List[str]] = {}
+        self.nodes = _NodeIndex()  # registered node ids, used by the ...Ids commands
+        self.next_id = 0
+        self.handlers: Dict[str, Callable[[List[Any]], Optional[List[Any]]]] = {
+            "echo": lambda args: list(args),
+            "getCapabilities": lambda args: [sorted(self.handlers)],
+            "createExplicit": lambda args: [self._register_graph(ExplicitGraph(args[0]))],
+            "createSimilarity": lambda args: [self._register_graph(SimilarityGraph(args[0]))],
+            "createModuleDistance": lambda args: [self._register_graph(ModuleDistanceGraph())],
+            "createCached": lambda args: [self._register_graph(CachedGraph(self._graph(args[0])))],
+            "createCombination": lambda args: [self._register_graph(CombinedGraph([self._graph(g) for g in args]))],
+            "createCombinationWeights": self._create_combination_weights,
+            "getGraphName": lambda args: [self._graph(args[0]).name],
+            "getGraphNodeSet": lambda args: [self._graph(args[0]).node_names()],
+            "saveNodeSet": lambda args: [self._register_node_set(self._graph(args[0]).node_names())],
+            "getNormalizedSupport": lambda args: [float(self._graph(args[0]).normalized_supports([args[1]])[0])],
+            "getNormalizedCoupling": lambda args: [float(self._graph(args[0]).normalized_couplings([args[1]], [args[2]])[0])],
+            "getNormalizedCouplings": self._get_normalized_couplings,
+            "getCouplingMatrix": self._get_coupling_matrix,
+            "getTopNeighborsIds": self._get_top_neighbors,
+            "save": self._save,
+            "load": self._load,
+            "getSaveLocation": lambda args: [self._save_location(args[0], args[1], args[2])],
+            "howWellPredictsMissingNode": self._how_well_predicts_missing_node,
+            "printStatistics": lambda args: print(self._graph(args[0]).statistics()),
+            "getMostLinkedNodePairs": lambda args: [[f"{w};{a};{b}" for w, a, b in self._explicit(args[0]).most_linked_node_pairs(int(args[1]))]],
+            "explicitAdd": lambda args: self._explicit(args[0]).add_edges([args[1]], [args[2]], float(args[3])),
+            "explicitAddSupport": lambda args: self._explicit(args[0]).add_supports([args[1]], float(args[2])),
+            "explicitAddAndSupport": lambda args: self._add_and_support(args[0], [args[1]], [args[2]], float(args[3])),
+            "explicitAddMany": self._explicit_add_many,
+            "explicitAddSupportMany": self._explicit_add_support_many,
+            "explicitAddAndSupportMany": self._explicit_add_and_support_many,
+            "explicitCutoffEdges": lambda args: self._explicit(args[0]).cutoff_edges(float(args[1])),
+            "explicitRemoveSmallComponents": lambda args: self._explicit(args[0]).remove_small_components(int(args[1])),
+            "explicitPropagateDown": lambda args: self._explicit(args[0]).propagate_down(int(args[1]), float(args[2])),
+            "explicitDilate": lambda args: self._explicit(args[0]).dilate(int(args[1]), float(args[2])),
+            "explicitGetData": lambda args: self._explicit(args[0]).get_data(),
+            "explicitExportData": lambda args: [self._explicit(args[0]).export_data(args[1])],
+            "getConnectedComponentSizes": lambda args: [np.sort(np.bincount(self._explicit(args[0]).component_labels()))],
+            "similarityAddNode": self._similarity_add_node,
+            "similarityAddNodesIds": self._similarity_add_nodes_ids,
+            "similarityGetNode": lambda args: self._similarity(args[0]).get_node(args[1]),
+            "similarityGetPairsAbove": self._similarity_get_pairs_above,
+            "combinedSetWeights": lambda args: self._combined(args[0]).set_weights([float(w) for w in args[1:]]),
+            "createNodeSet": lambda args: [self._register_node_set(list(args))],
+            "getNodeSet": lambda args: [self.node_sets[int(args[0])]],
+            "findDisagreements": self._find_disagreements,
+            "releaseGraph": lambda args: self.graphs.pop(int(args[0]), None) and None,
+            "releaseNodeSet": lambda args: self.node_sets.pop(int(args[0]), None) and None,
+            "memoryReport": self._memory_report,
+            "registerNodes": lambda args: [self.nodes.add(args).astype(np.int32)],
+            "createNodeSetIds": lambda args: [self._register_node_set(self._names(args))],
+            "howWellPredictsMissingNodeIds": lambda args: self._how_well_predicts_missing_node(self._with_names(args, 2, len(args))),
+            "howWellPredictsMissingNodesIds": lambda args: [self._how_well_predicts_missing_nodes(self._graph(args[0]), int(args[1]), None, args[2:])],
+            "howWellPredictsMissingNodesWeightsIds": self._how_well_predicts_missing_nodes_weights,
+            "getNormalizedCouplingsIds": lambda args: self._get_normalized_couplings(self._with_names(args, 2 + int(args[0]), 2 + int(args[0]) + 2 * int(args[1 + int(args[0])]))),
+            "explicitAddManyIds": lambda args: self._explicit_add_many(self._with_names(args, 2, 2 + 2 * int(args[1]))),
+            "explicitAddAndSupportManyIds": lambda args: self._explicit_add_and_support_many(self._with_names(args, 2, 2 + 2 * int(args[1]))),
+            "explicitAddSupportManyIds": lambda args: self._explicit_add_support_many(self._with_names(args, 2, 2 + int(args[1]))),
+        }
+
+    def execute(self, commands: List[Any]) -> List[Any]:
+        return self.execute_command(commands) or []
+
+    def execute_command(self, commands: List[Any]) -> Optional[List[Any]]:
+        """the result values, None for commands without a result"""
+        cmd, *args = _flatten(commands)
+        handler = self.handlers.get(cmd)
+        if handler is None:
+            raise Exception("Unknown command: " + str(cmd))
+        return handler(args)
+
+    def _names(self, node_ids: Sequence[int]) -> List[str]:
+        return [self.nodes.names[int(node_id)] for node_id in node_ids]
+
+    def _with_names(self, args: List[Any], start: int, end: int) -> List[Any]:
+        """the same arguments, with the registered node ids in args[start:end] replaced by their names"""
+        return args[:start] + self._names(args[start:end]) + args[end:]
+
+    def _memory_report(self, _args: List[Any]):
+        # kind;id;name;bytes
+        graphs = [f"graph;{graph_id};{graph.name};{graph.memory_usage()}" for graph_id, graph in self.graphs.items()]
+        node_sets = [f"nodeSet;{node_set_id};{len(nodes)} nodes;{_list_memory_usage(nodes)}" for node_set_id, nodes in self.node_sets.items()]
+        registered_nodes = [f"registeredNodes;0;{len(self.nodes)} nodes;{self.nodes.memory_usage()}"]
+        return [graphs + node_sets + registered_nodes]
+
+    def _register_graph(self, graph: BackendGraph) -> int:
+        self.next_id += 1
+        self.graphs[self.next_id] = graph
+        return self.next_id
+
+    def _register_node_set(self, nodes: List[str]) -> int:
+        self.next_id += 1
+        self.node_sets[self.next_id] = nodes
+        return self.next_id
+
+    def _graph(self, graph_id) -> BackendGraph:
+        return self.graphs[int(graph_id)]
+
+    def _typed_graph(self, graph_id, cls: Type[T]) -> T:
+        graph = self._graph(graph_id)
+        if not isinstance(graph, cls):
+            raise Exception(f"Graph {graph_id} is a {type(graph).__name__}, expected a {cls.__name__}!")
+        return graph
+
+    def _explicit(self, graph_id) -> ExplicitGraph:
+        return self._typed_graph(graph_id, ExplicitGraph)
+
+    def _similarity(self, graph_id) -> SimilarityGraph:
+        return self._typed_graph(graph_id, SimilarityGraph)
+
+    def _combined(self, graph_id) -> CombinedGraph:
+        return self._typed_graph(graph_id, CombinedGraph)
+
+    def _create_combination_weights(self, args: List[Any]):
+        graph_count = len(args) // 2
+        graphs = [self._graph(g) for g in args[:graph_count]]
+        return [self._register_graph(CombinedGraph(graphs, [float(w) for w in args[graph_count:]]))]
+
+    def _add_and_support(self, graph_id, a: Sequence[str], b: Sequence[str], deltas):
+        graph = self._explicit(graph_id)
+        graph.add_edges(a, b, deltas)
+        graph.add_supports(a, np.broadcast_to(deltas, len(a)))
+        graph.add_supports(b, np.broadcast_to(deltas, len(b)))
+
+    @staticmethod
+    def _bulk_edges(args: List[Any]) -> Tuple[List[str], List[str], np.ndarray]:
+        # bulk format: graph, count, then all first nodes, then all second nodes, then all deltas
+        count = int(args[1])
+        return args[2:2 + count], args[2 + count:2 + 2 * count], np.array(args[2 + 2 * count:2 + 3 * count], dtype=np.float64)
+
+    def _explicit_add_many(self, args: List[Any]):
+        self._explicit(args[0]).add_edges(*self._bulk_edges(args))
+
+    def _explicit_add_and_support_many(self, args: List[Any]):
+        self._add_and_support(args[0], *self._bulk_edges(args))
+
+    def _explicit_add_support_many(self, args: List[Any]):
+        count = int(args[1])
+        self._explicit(args[0]).add_supports(args[2:2 + count], np.array(args[2 + count:2 + 2 * count], dtype=np.float64))
+
+    def _similarity_get_pairs_above(self, args: List[Any]):
+        # graph, threshold. Result: pair count, all first nodes, all second nodes, all similarities
+        a, b, similarities = self._similarity(args[0]).pairs_above(float(args[1]))
+        return [len(a), a, b, similarities.astype(np.float64)]
+
+    def _similarity_add_node(self, args: List[Any]):
+        # graph, node, coordinates..., support
+        coordinates = np.array(args[2:-1], dtype=np.float64)
+        self._similarity(args[0]).add_nodes([args[1]], coordinates[None, :], np.array([float(args[-1])]))
+
+    def _similarity_add_nodes_ids(self, args: List[Any]):
+        # graph, node count, dimensions, node ids, coordinates (row by row), supports
+        count, dimensions = int(args[1]), int(args[2])
+        coordinates = np.array(args[3 + count:3 + count + count * dimensions], dtype=np.float64).reshape((count, dimensions))
+        self._similarity(args[0]).add_nodes(self._names(args[3:3 + count]), coordinates, np.array(args[3 + count + count * dimensions:], dtype=np.float64))
+
+    def _get_coupling_matrix(self, args: List[Any]):
+        # graph, node set, whether a dense result is required.
+        # Result: "sparse", node count, entry count, rows, columns, values of the upper triangle; or "dense", node count, all values
+        graph, nodes = self._graph(args[0]), self.node_sets[int(args[1])]
+        matrix = None if int(args[2]) else graph.sparse_coupling_matrix(nodes)
+        if matrix is None:
+            return ["dense", len(nodes), graph.dense_coupling_matrix(nodes)]
+        upper = sp.triu(matrix, k=1).tocoo()
+        return ["sparse", len(nodes), upper.nnz, upper.row.astype(np.int32), upper.col.astype(np.int32), upper.data.astype(np.float32)]
+
+    def _get_top_neighbors(self, args: List[Any]):
+        # graph, k, node ids. Result: the neighbour count of each node, then all neighbour names, then all their couplings
+        neighbors = self._graph(args[0]).top_neighbors(self._names(args[2:]), int(args[1]))
+        return [np.array([len(names) for names, _couplings in neighbors], dtype=np.int32),
+                [name for names, _couplings in neighbors for name in names],
+                np.concatenate([couplings for _names, couplings in neighbors] + [np.zeros(0)]).astype(np.float64)]
+
+    def _get_normalized_couplings(self, args: List[Any]):
+        # graph count, graph ids, pair count, all first nodes, all second nodes
+        graph_count = int(args[0])
+        graphs = [self._graph(g) for g in args[1:1 + graph_count]]
+        pair_count = int(args[1 + graph_count])
+        a = args[2 + graph_count:2 + graph_count + pair_count]
+        b = args[2 + graph_count + pair_count:2 + graph_count + 2 * pair_count]
+        return [np.column_stack([g.normalized_couplings(a, b) for g in graphs]).ravel()]
+
+    @staticmethod
+    def _save_location(repo_name: str, name: str, path: str) -> str:
+        return os.path.join(path, repo_name, name + ".npgraph")
+
+    def _save(self, args: List[Any]):
+        location = self._save_location(args[1], self._graph(args[0]).name, args[2])
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        with open(location, "wb") as f:
+            pickle.dump(self._graph(args[0]), f)
+
+    def _load(self, args: List[Any]):
+        with open(self._save_location(args[0], args[1], args[2]), "rb") as f:
+            return [self._register_graph(pickle.load(f))]
+
+    def _how_well_predicts_missing_node(self, args: List[Any]):
+        # graph, node set of all candidates, the missing node, the nodes that are known to belong together
+        graph = self._graph(args[0])
+        missing, others = args[2], args[3:]
+        others_set = set(others)
+        candidates = [node for node in self.node_sets[int(args[1])] if node not in others_set]
+        if missing not in candidates or len(others) == 0:
+            return [0.0]
+        scores = graph.coupling_matrix(candidates, others).mean(axis=1)
+        better_candidates = (scores > scores[candidates.index(missing)]).sum()
+        return [1 - better_candidates / max(1, len(candidates) - 1)]
+
+    def _how_well_predicts_missing_nodes_weights(self, args: List[Any]):
+        # combined graph, node set, weight count, the weights of each combination, then the tests
+        graph = self._combined(args[0])
+        weight_count = int(args[2])
+        weights = np.array(args[3:3 + weight_count * len(graph.graphs)], dtype=np.float64).reshape((weight_count, len(graph.graphs)))
+        return [self._how_well_predicts_missing_nodes(graph, int(args[1]), weights, args[3 + weight_count * len(graph.graphs):])]
+
+    def _how_well_predicts_missing_nodes(self, graph: BackendGraph, node_set_id: int, weights: Optional[np.ndarray], tests: List[Any]) -> np.ndarray:
+        """
+        the howWellPredictsMissingNode score of each test, tests given as test count, missing node ids, offsets into the other node ids, other node ids.
+        With weights, graph is a combined graph and the result has one row per weight combination, reusing the scores of its graphs for all of them
+        """
+        test_count = int(tests[0])
+        missing_nodes = self._names(tests[1:1 + test_count])
+        offsets = [int(offset) for offset in tests[1 + test_count:2 + 2 * test_count]]
+        other_nodes = self._names(tests[2 + 2 * test_count:])
+        if weights is None:
+            graphs, weights = [graph], np.ones((1, 1))
+        else:
+            used = weights.any(axis=0)
+            graphs, weights = [g for g, u in zip(graph.graphs, used) if u], weights[:, used]
+        total_weights = weights.sum(axis=1, keepdims=True)
+        all_nodes = self.node_sets[node_set_id]
+        result = np.zeros((len(weights), test_count))
+        for t, missing in enumerate(missing_nodes):
+            others = other_nodes[offsets[t]:offsets[t + 1]]
+            others_set = set(others)
+            candidates = [node for node in all_nodes if node not in others_set]
+            if missing not in candidates or len(others) == 0:
+                continue
+            graph_scores = np.zeros((len(graphs), len(candidates)))
+            for g, used_graph in enumerate(graphs):
+                graph_scores[g] = used_graph.coupling_matrix(candidates, others).mean(axis=1)
+            scores = (weights @ graph_scores) / np.where(total_weights == 0, 1, total_weights)  # weights, candidate
+            missing_index = candidates.index(missing)
+            better_candidates = (scores > scores[:, missing_index:missing_index + 1]).sum(axis=1)
+            result[:, t] = 1 - better_candidates / max(1, len(candidates) - 1)
+        return result.ravel()
+
+    def _find_disagreements(self, args: List[Any]):
+        """
+        for each pattern, find the node pairs of the node set whose couplings are closest to it.
+        Result, per pattern: for each found pair the sort values (the error for each used graph, then for the support),
+        the two node names and the display values (the coupling for each graph, then the support), and finally ""
+        """
+        nodes = self.node_sets[int(args[0])]
+        result_size, graph_count = int(args[1]), int(args[2])
+        graphs = [self._graph(g) for g in args[3:3 + graph_count]]
+        patterns = np.array(args[3 + graph_count:], dtype=np.float64).reshape((-1, graph_count))
+        supports = np.mean([g.normalized_supports(nodes) for g in graphs], axis=0)
+
+        # per pattern: scores, row indices, column indices, sort values, display values of the best pairs so far
+        best: List[Optional[Tuple[np.ndarray, ...]]] = [None for _p in patterns]
+        for start in range(0, len(nodes), MATRIX_BLOCK_SIZE):
+            rows = nodes[start:start + MATRIX_BLOCK_SIZE]
+            couplings = np.stack([g.coupling_matrix(rows, nodes) for g in graphs])  # graph, row, column
+            row_indices, column_indices = np.nonzero(np.arange(start, start + len(rows))[:, None] < np.arange(len(nodes))[None, :])
+            pair_couplings = couplings[:, row_indices, column_indices].T  # pair, graph
+            pair_supports = np.minimum(supports[start + row_indices], supports[column_indices])
+            display_values = np.column_stack([pair_couplings, pair_supports])
+            for p, pattern in enumerate(patterns):
+                used = ~np.isnan(pattern)
+                sort_values = np.column_stack([np.abs(pair_couplings[:, used] - pattern[used]), 1 - pair_supports])
+                scores = (sort_values * sort_values).sum(axis=1)
+                candidates = (scores, start + row_indices, column_indices, sort_values, display_values)
+                if best[p] is not None:
+                    candidates = tuple(np.concatenate([old, new]) for old, new in zip(best[p], candidates))
+                if len(candidates[0]) > result_size:
+                    keep = np.argpartition(candidates[0], result_size)[:result_size]
+                    candidates = tuple(c[keep] for c in candidates)
+                best[p] = candidates
+
+        result = []
+        for pattern_best in best:
+            if pattern_best is not None:
+                scores, row_indices, column_indices, sort_values, display_values = pattern_best
+                for i in np.argsort(scores, kind="stable"):
+                    result += sort_values[i].tolist() + [nodes[row_indices[i]], nodes[column_indices[i]]] + display_values[i].tolist()
+            result.append("")
+        return result
+
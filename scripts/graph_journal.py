@@ -0,0 +1,156 @@
+"""
+Journal of the commands that built up the graphs and node sets of a graph process,
+so that they can be restored when the process crashes. See GraphManager(journal=True).
+"""
+import tempfile
+from typing import *
+
+import numpy as np
+
+GRAPH = "graph"
+NODE_SET = "nodeSet"
+ObjectKey = Tuple[str, int]  # kind and id of a graph or node set in the graph process
+
+# commands that create a new object, whose id is their result
+CREATING_COMMANDS = {
+    "createExplicit": GRAPH, "createSimilarity": GRAPH, "createModuleDistance": GRAPH, "createCached": GRAPH,
+    "createCombination": GRAPH, "createCombinationWeights": GRAPH, "load": GRAPH,
+    "createNodeSet": NODE_SET, "createNodeSetIds": NODE_SET, "saveNodeSet": NODE_SET,
+}
+# commands that change the graph that is their first argument
+MUTATING_COMMANDS = {
+    "explicitAdd", "explicitAddSupport", "explicitAddAndSupport",
+    "explicitAddMany", "explicitAddSupportMany", "explicitAddAndSupportMany",
+    "explicitAddManyIds", "explicitAddSupportManyIds", "explicitAddAndSupportManyIds",
+    "explicitCutoffEdges", "explicitRemoveSmallComponents", "explicitPropagateDown", "explicitDilate",
+    "similarityAddNode", "similarityAddNodesIds", "combinedSetWeights",
+}
+RELEASING_COMMANDS = {"releaseGraph": GRAPH, "releaseNodeSet": NODE_SET}
+# graphs that can be saved and loaded again, so that their journal can be replaced by a checkpoint
+CHECKPOINT_NAME_ARGUMENT = {"createExplicit": 1, "createSimilarity": 1, "load": 2}
+
+_WITHOUT_IDS = {
+    "echo", "getCapabilities", "setProtocol", "createExplicit", "createSimilarity", "createModuleDistance", "load", "getSaveLocation",
+    "registerNodes", "createNodeSet", "createNodeSetIds", "memoryReport",
+}
+# (argument index, kind) of all object ids in a command, if it is not just a graph as first argument
+_ID_ARGUMENTS: Dict[str, List[Tuple[int, str]]] = {
+    "getNodeSet": [(1, NODE_SET)],
+    "releaseNodeSet": [(1, NODE_SET)],
+    "createCombination": [(1, GRAPH)],
+    "createCombinationWeights": [(1, GRAPH)],
+    "getCouplingMatrix": [(1, GRAPH), (2, NODE_SET)],
+    "getNormalizedCouplings": [(2, GRAPH)],
+    "getNormalizedCouplingsIds": [(2, GRAPH)],
+    "howWellPredictsMissingNode": [(1, GRAPH), (2, NODE_SET)],
+    "howWellPredictsMissingNodeIds": [(1, GRAPH), (2, NODE_SET)],
+    "howWellPredictsMissingNodesIds": [(1, GRAPH), (2, NODE_SET)],
+    "howWellPredictsMissingNodesWeightsIds": [(1, GRAPH), (2, NODE_SET)],
+    "findDisagreements": [(1, NODE_SET), (4, GRAPH)],
+}
+
+
+def _payload_size(commands: List[Any]) -> int:
+    """roughly the memory that keeping these commands takes, dominated by the arrays of bulk commands"""
+    size = 0
+    for value in commands:
+        if isinstance(value, np.ndarray):
+            size += value.nbytes
+        elif isinstance(value, (list, tuple)):
+            size += sum(len(v) if isinstance(v, str) else 8 for v in value)
+        else:
+            size += len(value) if isinstance(value, str) else 8
+    return size
+
+
+def _untagged(commands: List[Any]) -> List[Any]:
+    """without the request id of pipelined commands"""
+    if isinstance(commands[0], str) and commands[0].startswith("@"):
+        return commands[1:]
+    return commands
+
+
+def _id_arguments(cmd: str) -> List[Tuple[int, str]]:
+    if cmd in _WITHOUT_IDS:
+        return []
+    return _ID_ARGUMENTS.get(cmd, [(1, GRAPH)])
+
+
+def _translate_value(value: Any, kind: str, id_map: Dict[ObjectKey, int]) -> Any:
+    if isinstance(value, np.ndarray):
+        return np.array([id_map.get((kind, int(v)), int(v)) for v in value.ravel()], dtype=value.dtype)
+    if isinstance(value, (list, tuple)):
+        return [_translate_value(v, kind, id_map) for v in value]
+    if isinstance(value, str):
+        return str(id_map.get((kind, int(value)), value)) if value.isdigit() else value
+    return id_map.get((kind, int(value)), value)
+
+
+def translate_ids(commands: List[Any], id_map: Dict[ObjectKey, int]) -> List[Any]:
+    """the same commands, with the ids of all restored objects replaced by their new ones"""
+    offset = len(commands) - len(_untagged(commands))
+    result = list(commands)
+    for index, kind in _id_arguments(result[offset]):
+        if offset + index < len(result):
+            result[offset + index] = _translate_value(result[offset + index], kind, id_map)
+    return result
+
+
+class GraphJournal:
+    def __init__(self, checkpoint_interval: int, checkpoint_bytes: int, directory: Optional[str] = None):
+        # by object, in creation order: the command that created it, and all changes to it since
+        self.entries: Dict[ObjectKey, List[List[Any]]] = {}
+        self.entry_bytes: Dict[ObjectKey, int] = {}  # payload of the changes in entries, see _payload_size
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self.directory = tempfile.mkdtemp(prefix="coupling_graph_journal_") if directory is None else directory
+        self.checkpoint_counts: Dict[ObjectKey, int] = {}
+        self.last_change: Optional[Tuple[ObjectKey, List[Any]]] = None
+
+    def record_sent(self, commands: List[Any]) -> Optional[ObjectKey]:
+        """remember changes and releases, returns the graph that should get a checkpoint now, if any"""
+        commands = _untagged(commands)
+        cmd = commands[0]
+        if cmd in MUTATING_COMMANDS:
+            key = (GRAPH, int(commands[1]))
+            if key in self.entries:
+                self.entries[key].append(commands)
+                self.entry_bytes[key] = self.entry_bytes.get(key, 0) + _payload_size(commands)
+                self.last_change = (key, commands)
+                too_big = len(self.entries[key]) > self.checkpoint_interval or self.entry_bytes[key] > self.checkpoint_bytes
+                if too_big and self.entries[key][0][0] in CHECKPOINT_NAME_ARGUMENT:
+                    return key
+        elif cmd in RELEASING_COMMANDS:
+            key = (RELEASING_COMMANDS[cmd], int(commands[1]))
+            self.entries.pop(key, None)
+            self.entry_bytes.pop(key, None)
+        return None
+
+    def record_result(self, commands: List[Any], result: str):
+        commands = _untagged(commands)
+        if commands[0] in CREATING_COMMANDS:
+            key = (CREATING_COMMANDS[commands[0]], int(result))
+            self.entries[key] = [commands]
+            self.entry_bytes[key] = 0
+
+    def forget_last_change(self, commands: List[Any]):
+        """these commands will be sent again after restoring, so they must not be replayed as well"""
+        if self.last_change is None or self.last_change[1] is not _untagged(commands):
+            return
+        key, change = self.last_change
+        if key in self.entries and self.entries[key][-1] is change:
+            self.entries[key].pop()
+            self.entry_bytes[key] -= _payload_size(change)
+        self.last_change = None
+
+    def next_checkpoint(self, key: ObjectKey) -> Tuple[str, str, str]:
+        """repo name, graph name and path to save the graph to"""
+        count = self.checkpoint_counts.get(key, 0)
+        self.checkpoint_counts[key] = count + 1
+        creation = self.entries[key][0]
+        # alternating between two locations, so that a crash while saving does not break the previous checkpoint
+        return f"{key[1]}_{count % 2}", creation[CHECKPOINT_NAME_ARGUMENT[creation[0]]], self.directory + "/"
+
+    def set_checkpoint(self, key: ObjectKey, load_command: List[Any]):
+        self.entries[key] = [load_command]
+        self.entry_bytes[key] = 0
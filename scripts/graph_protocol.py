@@ -0,0 +1,100 @@
+"""
+The protocol between graph.py and the graph process: command types, binary frames and the text representation of values.
+Kept free of any graph process handling, so that graph_server.py can use it as well
+"""
+import struct
+from typing import *
+
+import numpy as np
+
+CommandPart = Union[str, int, float, Sequence[str], np.ndarray]
+Command = List[CommandPart]
+
+# binary protocol: every frame is a little-endian uint32 byte length, followed by the frame content:
+# uint32 value count, then per value a one-byte type tag and its data:
+#   s: string (uint32 byte length + utf-8), i: int64, d: float64,
+#   S: string list (uint32 count + strings), I / f / D: int32 / float32 / float64 array (uint32 count + data)
+# frames from the graph process start with their kind: "#result" (+ request id, -1 if untagged), "#progress", "#log"
+# or "#error" (+ message, + request id if it was pipelined)
+UINT32 = struct.Struct("<I")
+_INT64 = struct.Struct("<q")
+_FLOAT64 = struct.Struct("<d")
+_ARRAY_TYPES: Dict[bytes, np.dtype] = {b"I": np.dtype("<i4"), b"f": np.dtype("<f4"), b"D": np.dtype("<f8")}
+
+
+def encode_frame(values: Command) -> bytes:
+    parts = [UINT32.pack(len(values))]
+    for value in values:
+        if isinstance(value, str):
+            data = value.encode("utf-8")
+            parts += [b"s", UINT32.pack(len(data)), data]
+        elif isinstance(value, (int, np.integer)):
+            parts += [b"i", _INT64.pack(int(value))]
+        elif isinstance(value, (float, np.floating)):
+            parts += [b"d", _FLOAT64.pack(float(value))]
+        elif isinstance(value, np.ndarray):
+            if np.issubdtype(value.dtype, np.integer):
+                tag = b"I"
+            elif value.dtype == np.float32:
+                tag = b"f"
+            else:
+                tag = b"D"
+            array = np.ascontiguousarray(value.ravel(), dtype=_ARRAY_TYPES[tag])
+            parts += [tag, UINT32.pack(len(array)), array.tobytes()]
+        else:
+            encoded = [v.encode("utf-8") for v in value]
+            parts += [b"S", UINT32.pack(len(encoded))] + [UINT32.pack(len(e)) + e for e in encoded]
+    content = b"".join(parts)
+    return UINT32.pack(len(content)) + content
+
+
+def decode_frame(content: bytes) -> List[Any]:
+    view = memoryview(content)
+    (count,) = UINT32.unpack_from(view, 0)
+    pos = 4
+    values = []
+    for _ in range(count):
+        tag = bytes(view[pos:pos + 1])
+        pos += 1
+        if tag == b"i":
+            values.append(_INT64.unpack_from(view, pos)[0])
+            pos += 8
+        elif tag == b"d":
+            values.append(_FLOAT64.unpack_from(view, pos)[0])
+            pos += 8
+        elif tag == b"s":
+            (length,) = UINT32.unpack_from(view, pos)
+            values.append(str(view[pos + 4:pos + 4 + length], "utf-8"))
+            pos += 4 + length
+        elif tag == b"S":
+            (length,) = UINT32.unpack_from(view, pos)
+            pos += 4
+            strings = []
+            for _i in range(length):
+                (string_length,) = UINT32.unpack_from(view, pos)
+                strings.append(str(view[pos + 4:pos + 4 + string_length], "utf-8"))
+                pos += 4 + string_length
+            values.append(strings)
+        elif tag in _ARRAY_TYPES:
+            (length,) = UINT32.unpack_from(view, pos)
+            dtype = _ARRAY_TYPES[tag]
+            values.append(np.frombuffer(content, dtype, length, pos + 4))  # no copy, read-only
+            pos += 4 + length * dtype.itemsize
+        else:
+            raise Exception("Unknown value type in graph frame: " + repr(tag))
+    return values
+
+
+def to_text_parts(values: Command) -> List[str]:
+    """the text protocol representation of the given values: lists and arrays are spread into one part per element"""
+    parts = []
+    for value in values:
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, np.ndarray):
+            parts += [str(v) for v in value.ravel().tolist()]
+        elif isinstance(value, (list, tuple)):
+            parts += [str(v) for v in value]
+        else:
+            parts.append(str(value))
+    return parts
@@ -0,0 +1,67 @@
+"""
+Replays a command stream that was recorded with COUPLING_GRAPH_RECORD_FILE, and reports the throughput of the graph backend.
+The backend is chosen just like for all other scripts (COUPLING_GRAPH_BACKEND, COUPLING_GRAPH_EXECUTABLE, COUPLING_GRAPH_PROTOCOL),
+so the same recording can be used to compare them. Graph ids are replayed as recorded, which works as long as the backend
+assigns them in the same order, as it does for a fresh process.
+
+Usage: python graph_replay.py <recording> [repetitions]
+"""
+import os
+import sys
+import time
+from typing import *
+
+from graph import GraphFuture, GraphManager, graph_manager
+from graph_protocol import Command, UINT32, decode_frame
+from util import log_progress
+
+
+def read_recording(path: str) -> List[Tuple[str, Command]]:
+    """(kind, command) for each recorded command, see GraphManager._record"""
+    result = []
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(UINT32.size)
+            if len(header) < UINT32.size:
+                return result
+            (length,) = UINT32.unpack(header)
+            kind, *commands = decode_frame(f.read(length))
+            result.append((kind, commands))
+
+
+def replay(manager: GraphManager, recording: List[Tuple[str, Command]]) -> float:
+    """the seconds it took until all results were there"""
+    start = time.perf_counter()
+    futures: List[GraphFuture] = []
+    for kind, commands in log_progress(recording, desc="Replaying"):
+        if kind == "v":
+            manager.execute_void(commands)
+        elif kind == "r":
+            manager.execute_values(commands)
+        elif kind == "p":
+            futures.append(manager.submit(commands))
+        else:
+            raise Exception("Unknown recorded command kind: " + kind)
+    for future in futures:
+        future.result()
+    manager.flush()
+    seconds = time.perf_counter() - start
+    for kind, commands in recording:
+        if commands[0] == "explicitExportData" and os.path.exists(commands[2]):
+            os.remove(commands[2])  # graph.py deletes them right after mapping them, but the replay does not read them
+    return seconds
+
+
+def main():
+    recording = read_recording(sys.argv[1])
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    for repetition in range(repetitions):
+        # each repetition needs the ids that a fresh backend assigns
+        manager = graph_manager if repetition == 0 else type(graph_manager)()
+        seconds = replay(manager, recording)
+        print(f"Repetition {repetition + 1}: {len(recording)} commands in {seconds:.3f}s, {len(recording) / seconds:.0f} commands per second")
+        manager.print_stats()
+
+
+if __name__ == "__main__":
+    main()
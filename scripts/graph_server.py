@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Stand-alone graph process, speaking the same text and binary protocol as the coupling graph executable,
+with graph_backend.py doing the actual work. Use it where that executable is not available:
+COUPLING_GRAPH_EXECUTABLE=path/to/graph_server.py
+
+Text commands are untyped: all their parts are passed on as strings, and the handlers convert them as needed.
+"""
+import contextlib
+import sys
+from typing import *
+
+from graph_backend import GraphBackend
+from graph_protocol import UINT32, encode_frame, decode_frame, to_text_parts
+
+
+def _explicit_data_text(result: List[Any]) -> List[str]:
+    """like the c++ executable: format, ";"-joined node names, ";"-joined supports, ";"-joined "n1,n2,weight" edges"""
+    type_name, names, supports, sources, targets, weights = result
+    edges = ";".join(f"{a},{b},{w}" for a, b, w in zip(sources.tolist(), targets.tolist(), weights.tolist()))
+    return [type_name, ";".join(names), ";".join(str(s) for s in supports.tolist()), edges]
+
+
+# results that the text protocol represents differently than by spreading all values into parts
+_TEXT_RESULTS: Dict[str, Callable[[List[Any]], List[str]]] = {
+    "explicitGetData": _explicit_data_text,
+}
+
+
+class GraphServer:
+    def __init__(self, input_stream: BinaryIO, output_stream: BinaryIO):
+        self.backend = GraphBackend()
+        self.input = input_stream
+        self.output = output_stream
+        self.binary = False
+
+    def run(self):
+        while True:
+            commands = self._read_command()
+            if commands is None:
+                return
+            request_id = None
+            if isinstance(commands[0], str) and commands[0].startswith("@"):  # pipelined
+                request_id = int(commands[0][1:])
+                commands = commands[1:]
+            if not self.binary and commands == ["setProtocol", "binary"]:
+                self._write_text_result(request_id, ["binary"])
+                self.binary = True
+                continue
+            try:
+                # in binary mode, anything printed by the backend would corrupt the frames
+                with contextlib.redirect_stdout(sys.stderr) if self.binary else contextlib.nullcontext():
+                    result = self.backend.execute_command(commands)
+                if commands == ["getCapabilities"]:
+                    result = [result[0] + ["pipelined"]]  # request ids are handled here, not by the backend
+            except Exception as e:
+                self._write_error(request_id, str(e))
+                continue
+            if result is None and request_id is None:
+                continue  # the client does not wait for anything
+            if self.binary:
+                self._write(encode_frame(["#result", -1 if request_id is None else request_id] + (result or [])))
+            else:
+                self._write_text_result(request_id, _TEXT_RESULTS.get(commands[0], lambda values: values)(result or []))
+
+    def _read_command(self) -> Optional[List[Any]]:
+        """None at the end of the input"""
+        if self.binary:
+            header = self.input.read(UINT32.size)
+            if len(header) < UINT32.size:
+                return None
+            (length,) = UINT32.unpack(header)
+            return decode_frame(self.input.read(length))
+        line = self.input.readline()
+        if len(line) == 0:
+            return None
+        return line.decode("utf-8").rstrip("\n").split("|")
+
+    def _write_text_result(self, request_id: Optional[int], result: List[Any]):
+        tag = "" if request_id is None else "@" + str(request_id)
+        self._write(("#result" + tag + " " + "|".join(to_text_parts(result)) + "\n").encode("utf-8"))
+
+    def _write_error(self, request_id: Optional[int], message: str):
+        """errors of pipelined commands carry their request id, so that the client knows which one failed"""
+        message = message.replace("\n", " ")
+        if self.binary:
+            self._write(encode_frame(["#error", message] + ([] if request_id is None else [request_id])))
+        elif request_id is not None:
+            self._write(("#error@" + str(request_id) + " " + message + "\n").encode("utf-8"))
+        elif message.startswith("Unknown command"):
+            self._write((message + "\n").encode("utf-8"))
+        else:
+            self._write(("#error " + message + "\n").encode("utf-8"))
+
+    def _write(self, data: bytes):
+        self.output.write(data)
+        self.output.flush()
+
+
+if __name__ == "__main__":
+    GraphServer(sys.stdin.buffer, sys.stdout.buffer).run()
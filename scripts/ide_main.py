@@ -8,6 +8,9 @@ from metrics import *
 from analysis import *
 
 
+# the plugin addresses graphs by id only, so all of them need to live in the default graph manager
+graph_managers.use_only(graph_manager)
+
 print("IDE endpoint script ready")
 while True:
     cmd = input()
@@ -21,5 +24,13 @@ while True:
         repo_name, view_name = cmd[len("getGraph "):].split("|")
         graph_id = MetricManager.get(LocalRepo.for_name(repo_name), view_name).id
         print("#result " + str(graph_id))
+    elif cmd.startswith("getNeighbors "):
+        repo_name, view_name, k, node = cmd[len("getNeighbors "):].split("|")
+        try:
+            neighbors = MetricManager.get(LocalRepo.for_name(repo_name), view_name).top_k_neighbors(node, int(k))
+            print("#result " + "|".join(name + ";" + str(coupling) for name, coupling in neighbors))
+        except Exception as e:  # keep serving the plugin
+            print("#error " + str(e))
+        sys.stdout.flush()
     else:
         print("Unknown command!", cmd)
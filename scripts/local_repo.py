@@ -1,7 +1,13 @@
 from git import Git, Repo, RemoteProgress, Commit
+import atexit
+import multiprocessing
 import os
+import pickle
 import subprocess
+import sys
+import types
 import pdb
+from collections import OrderedDict
 from typing import List
 import re
 
@@ -11,6 +17,10 @@ from parsing import *
 REPO_URL_START = "https://github.com/"
 REPO_URL_END = ".git"
 REPO_CLONE_PATH = "../repos/"
+PARSE_CACHE_PATH = "../parse_cache/"
+PARSE_CACHE_VERSION = 1  # increase when walk_tree_cursor finds different declarations, or get_all_interesting_files picks different files
+BLOB_CACHE_MAX_BYTES = 64 * 1024 * 1024  # per repo and process
+PARALLEL_PARSE_MIN_FILES = 256  # below this many files that are not in the parse cache yet, starting the worker processes is not worth it
 ADD_LINE_NUMBER_TO_LINK = True
 
 
@@ -35,6 +45,70 @@ def path_html(repo: 'LocalRepo', path: str) -> str:
 _LOCAL_REPO_CACHE: Dict[str, 'LocalRepo'] = dict()
 
 
+class BlobReader:
+    """
+    reads blob contents by sha from one long-running `git cat-file --batch` process, and keeps the most recently used ones.
+    GitPython opens new streams (and leaks their file handles) for each blob instead.
+    """
+
+    def __init__(self, repo_path: str, max_cached_bytes: int = BLOB_CACHE_MAX_BYTES):
+        self.repo_path = repo_path
+        self.max_cached_bytes = max_cached_bytes
+        self.contents: OrderedDict[str, bytes] = OrderedDict()
+        self.cached_bytes = 0
+        self.process: Optional[subprocess.Popen] = None
+        self.process_owner_pid = None
+
+    def read(self, sha: str) -> bytes:
+        content = self.contents.get(sha)
+        if content is not None:
+            self.contents.move_to_end(sha)
+            return content
+        content = self._read_from_git(sha)
+        if len(content) <= self.max_cached_bytes:
+            self.contents[sha] = content
+            self.cached_bytes += len(content)
+            while self.cached_bytes > self.max_cached_bytes:
+                self.cached_bytes -= len(self.contents.popitem(last=False)[1])
+        return content
+
+    def _read_from_git(self, sha: str) -> bytes:
+        if self.process is None or self.process_owner_pid != os.getpid() or self.process.poll() is not None:
+            # a forked worker process cannot use the pipes of its parent
+            self.process = subprocess.Popen(["git", "cat-file", "--batch"], cwd=self.repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self.process_owner_pid = os.getpid()
+        self.process.stdin.write(sha.encode("ascii") + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode("utf-8").split()  # <sha> <type> <size>, or <sha> missing
+        if len(header) != 3:
+            raise Exception("Cannot read blob " + sha + " from " + self.repo_path + ": " + " ".join(header))
+        content = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)  # the newline after each object
+        return content
+
+    def close(self):
+        if self.process is not None and self.process_owner_pid == os.getpid():
+            self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+        self.process = None
+
+
+_BLOB_READERS: Dict[str, BlobReader] = dict()  # by repo path, shared by all LocalRepo instances of a repo
+
+
+def get_blob_reader(repo_path: str) -> BlobReader:
+    if repo_path not in _BLOB_READERS:
+        _BLOB_READERS[repo_path] = BlobReader(repo_path)
+    return _BLOB_READERS[repo_path]
+
+
+@atexit.register
+def _close_blob_readers():
+    for reader in _BLOB_READERS.values():
+        reader.close()
+
+
 # https://gitpython.readthedocs.io/en/stable/reference.html
 class LocalRepo:
     __creation_token = object()
@@ -134,10 +208,10 @@ class LocalRepo:
                 self.url_cache[path] = file_url
                 return file_url
             target_node = self.get_tree().find_node(path)
-            if target_node is None or target_node.ts_node is None:
+            if target_node is None or target_node.declaration is None:
                 self.url_cache[path] = file_url
                 return file_url
-            before_content = decode(file.get_content()[:target_node.ts_node.start_byte])
+            before_content = decode(file.get_content()[:target_node.declaration.start_byte])
             result_url = file_url + "#L" + str(len(before_content.split("\n")))
             self.url_cache[path] = result_url
             return result_url
@@ -155,15 +229,17 @@ class LocalRepo:
                 self.path_to_file_cache[repo_file.get_path()] = repo_file
         return self.path_to_file_cache.get(path)
 
-    def get_file_objects(self):
-        commit = self.get_head_commit()
-        ending = "." + self.type_extension()
-        files = []
-        for git_object in commit.tree.traverse():
-            if git_object.type == "blob":
-                if git_object.name.endswith(ending) and not git_object.name.endswith("module-info.java"):
-                    files.append(git_object)
-        return files
+    def get_file_objects(self) -> List['_BlobInfo']:
+        tree = self.get_head_commit().tree
+        if tree.hexsha not in _FILE_OBJECTS_CACHE:
+            ending = "." + self.type_extension()
+            files = []
+            for git_object in tree.traverse():
+                if git_object.type == "blob":
+                    if git_object.name.endswith(ending) and not git_object.name.endswith("module-info.java"):
+                        files.append(_BlobInfo(git_object.path, git_object.hexsha))
+            _FILE_OBJECTS_CACHE[tree.hexsha] = files
+        return _FILE_OBJECTS_CACHE[tree.hexsha]
 
     def get_all_files(self) -> List['RepoFile']:
         if self.sub_dir is None:
@@ -172,15 +248,32 @@ class LocalRepo:
             return [RepoFile(self, o) for o in self.get_file_objects() if o.path.startswith(self.sub_dir)]
 
     def get_all_interesting_files(self) -> List['RepoFile']:
-        test_skipper = DirectoryExclusionTracker(['test', 'tests', 'samples', 'example', 'examples', 'androidTest'])
-        all_files = self.get_all_files()
-        result = [file for file in all_files if not (file.should_get_skipped() or test_skipper.should_get_skipped(file.get_path()))]
-        # print("Analyzing", len(result), "of", len(all_files), "files, the rest was skipped as tests or samples")
-        # print("Skipped", len(test_skipper.get_skipped_roots()), "test and sample roots:", test_skipper.get_skipped_roots())
-        return result
+        """new RepoFile objects each time, but which files those are is only found out once per tree"""
+        cache_path = _interesting_files_cache_path(self.get_head_commit().tree.hexsha, self.sub_dir)
+        if cache_path not in _INTERESTING_FILES_CACHE:
+            entry = _load_pickle(cache_path)
+            if entry is None:
+                test_skipper = DirectoryExclusionTracker(['test', 'tests', 'samples', 'example', 'examples', 'androidTest'])
+                all_files = self.get_all_files()
+                result = []
+                for file in all_files:
+                    # in this order, since the test skipper remembers the roots of all paths it has seen skipped
+                    if not (_get_skip_decision(file) or test_skipper.should_get_skipped(file.get_path())):
+                        result.append(file)
+                # print("Analyzing", len(result), "of", len(all_files), "files, the rest was skipped as tests or samples")
+                # print("Skipped", len(test_skipper.get_skipped_roots()), "test and sample roots:", test_skipper.get_skipped_roots())
+                entry = _FileList([file.file_obj for file in result], {file.file_obj.hexsha: _SKIP_DECISIONS[file.file_obj.hexsha] for file in all_files})
+                _save_pickle(cache_path, entry)
+            else:
+                _SKIP_DECISIONS.update(entry.skip_decisions)  # for other trees that share these blobs
+            _INTERESTING_FILES_CACHE[cache_path] = entry.files
+        return [RepoFile(self, o) for o in _INTERESTING_FILES_CACHE[cache_path]]
 
     def get_file_object_content(self, git_object):
-        return git_object.data_stream.read()
+        return self.get_blob(git_object.hexsha)
+
+    def get_blob(self, sha: str) -> bytes:
+        return get_blob_reader(self.path()).read(sha)
 
     def get_all_commits(self) -> List[str]:
         commit_hash_list: List[str] = Git(self.path()).log("--pretty=%H").split("\n")
@@ -240,17 +333,97 @@ class LocalRepo:
     def __setstate__(self, state):
         """Restore state from the unpickled state values."""
         self.name, self.repo_name, self.sub_dir, self.repo, self.committish = state
+        self.tree = None
+        self.url_cache = {}
+        self.path_to_file_cache = None
+
+
+class Declaration(NamedTuple):
+    """the parts of a tree-sitter declaration node that a RepoTree needs, without having to keep the parsed file around"""
+    type: str
+    start_byte: int
+    end_byte: int
+    start_point: Tuple[int, int]
+    end_point: Tuple[int, int]
+
+    @staticmethod
+    def of(ts_node) -> 'Declaration':
+        return Declaration(ts_node.type, ts_node.start_byte, ts_node.end_byte, tuple(ts_node.start_point), tuple(ts_node.end_point))
+
+
+class _BlobInfo(NamedTuple):
+    """all that RepoFile needs of a git blob, and unlike the blob it can be cached and sent to other processes"""
+    path: str
+    hexsha: str
+
+
+_FILE_OBJECTS_CACHE: Dict[str, List[_BlobInfo]] = dict()  # by tree sha
+_INTERESTING_FILES_CACHE: Dict[str, List[_BlobInfo]] = dict()  # by cache file path
+_SKIP_DECISIONS: Dict[str, bool] = dict()  # by blob sha, from all file lists computed or loaded so far
+
+
+class _FileList(NamedTuple):
+    """what is cached on disk for each tree: its interesting files, and the skip decision for each of its blobs"""
+    files: List[_BlobInfo]
+    skip_decisions: Dict[str, bool]
+
+
+def _parse_cache_dir() -> str:
+    return PARSE_CACHE_PATH + "v" + str(PARSE_CACHE_VERSION) + "/"
+
+
+def _parse_cache_path(blob_sha: str) -> str:
+    return _parse_cache_dir() + blob_sha[:2] + "/" + blob_sha[2:] + ".pickle"
+
+
+def _interesting_files_cache_path(tree_sha: str, sub_dir: Optional[str]) -> str:
+    return _parse_cache_dir() + "files/" + tree_sha + ("" if sub_dir is None else "_" + sub_dir.replace("/", "_")) + ".pickle"
+
+
+def _load_pickle(path: str):
+    """None if there is no such file yet"""
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _save_pickle(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(data, f)
+    os.replace(temp_path, path)  # other processes may be writing the same file at the same time
+
+
+def _load_declarations(blob_sha: str) -> Optional[List[Tuple[str, Declaration]]]:
+    return _load_pickle(_parse_cache_path(blob_sha))
+
+
+def _save_declarations(blob_sha: str, declarations: List[Tuple[str, Declaration]]):
+    _save_pickle(_parse_cache_path(blob_sha), declarations)
+
+
+def _get_skip_decision(file: 'RepoFile') -> bool:
+    """should_get_skipped, decided only once per blob sha and stored with the file lists of the trees, see get_all_interesting_files"""
+    blob_sha = file.file_obj.hexsha
+    if blob_sha not in _SKIP_DECISIONS:
+        _SKIP_DECISIONS[blob_sha] = file.should_get_skipped()
+    return _SKIP_DECISIONS[blob_sha]
+
+
+SKIP_FILE_MIN_LINES = 20000
+SKIP_FILE_MIN_LINE_LENGTH = 5000
 
 
 def should_skip_file(content_bytes):
-    content_str = decode(content_bytes)
-    lines = content_str.split("\n")
-    if len(lines) >= 20000:
-        return True
-    max_line_length = max((len(line) for line in lines))
-    if max_line_length >= 5000:
+    if content_bytes.count(b"\n") + 1 >= SKIP_FILE_MIN_LINES:
         return True
-    return False
+    if max(map(len, content_bytes.split(b"\n"))) < SKIP_FILE_MIN_LINE_LENGTH:
+        return False  # a line never has more characters than bytes, so no need to decode anything
+    content_str = decode(content_bytes)
+    max_line_length = max((len(line) for line in content_str.split("\n")))
+    return max_line_length >= SKIP_FILE_MIN_LINE_LENGTH
 
 
 class RepoFile:
@@ -287,22 +460,49 @@ class RepoFile:
         return decode(self.get_content())
 
     def get_repo_tree_node(self):
-        return self.repo.get_tree().find_node(self.get_path())
+        node = self.repo.get_tree().find_node(self.get_path())
+        if node is not None and self.tree is not None:
+            node.resolve_declarations(self)  # this file is parsed already, so don't parse it again later on
+        return node
 
     def get_tree(self):
         if self.tree is None:
             self.tree = java_parser.parse(self.get_content())
         return self.tree
 
+    def get_declarations(self) -> List[Tuple[str, Declaration]]:
+        """(logic path, declaration) for everything that walk_tree finds, cached on disk by blob sha, so each file content only gets parsed once"""
+        declarations = self.get_cached_declarations()
+        if declarations is None:
+            # paths are stored relative to the file, since the same blob can live at other paths too
+            relative_declarations = []
+            parsed = self.walk_tree(lambda logic_path, ts_node: relative_declarations.append((logic_path[len(self.get_path()):], Declaration.of(ts_node))))
+            if parsed:  # a partial result should not stay cached forever, but be tried again next time
+                _save_declarations(self.file_obj.hexsha, relative_declarations)
+            declarations = self._with_own_path(relative_declarations)
+        return declarations
+
+    def get_cached_declarations(self) -> Optional[List[Tuple[str, Declaration]]]:
+        """like get_declarations, but None instead of parsing the file"""
+        relative_declarations = _load_declarations(self.file_obj.hexsha)
+        if relative_declarations is None:
+            return None
+        return self._with_own_path(relative_declarations)
+
+    def _with_own_path(self, relative_declarations: List[Tuple[str, Declaration]]) -> List[Tuple[str, Declaration]]:
+        return [(self.get_path() + relative_path, declaration) for relative_path, declaration in relative_declarations]
+
     def node_text(self, node):
         return decode(self.get_content()[node.start_byte:node.end_byte])
 
-    def walk_tree(self, node_handler):
-        """ node_handler gets the current logic-path and node for each ast node"""
+    def walk_tree(self, node_handler) -> bool:
+        """ node_handler gets the current logic-path and node for each ast node. False if that failed somewhere in between"""
         try:
             self.walk_tree_cursor(self.get_tree().walk(), self.get_path(), node_handler)
+            return True
         except Exception as e:
             print("Failed to parse file:", self.get_path(), "Error:", e)
+            return False
 
     def walk_tree_cursor(self, cursor, prefix, node_handler):
         if not cursor.node.is_named:
@@ -333,37 +533,107 @@ class RepoFile:
             cursor.goto_parent()
 
 
+def _find_declarations(file_data: Tuple[str, str, bytes]) -> Tuple[str, List[Tuple[str, Declaration]]]:
+    """run by the worker processes of RepoTree.init_from_repo"""
+    path, blob_sha, content = file_data
+    file = RepoFile(None, _BlobInfo(path, blob_sha))
+    file.content = content
+    return path, file.get_declarations()
+
+
+_NO_CHILDREN: Mapping[str, 'RepoTree'] = types.MappingProxyType({})  # shared by all leaves, until they get a child
+
+
 class RepoTree:
+    # there are hundreds of thousands of these in big repos, most of them being leaves
+    __slots__ = ("parent", "name", "declaration", "additional_declarations", "children", "repo", "_path", "_path_index")
+
     @staticmethod
     def init_from_repo(repo) -> 'RepoTree':
         found_nodes = RepoTree(None, "")
+        found_nodes.repo = repo
         files = repo.get_all_interesting_files()
+        file_declarations: Dict[str, List[Tuple[str, Declaration]]] = {}
+        files_to_parse = []
         for file in files:
-            def handle(logic_path, ts_node):
-                found_nodes.register(logic_path, ts_node)
-
-            file.walk_tree(handle)
+            declarations = file.get_cached_declarations()
+            if declarations is None:
+                files_to_parse.append(file)
+            else:
+                file_declarations[file.get_path()] = declarations
+        map_parallel(
+            [(file.get_path(), file.file_obj.hexsha, file.get_content()) for file in files_to_parse],
+            _find_declarations,
+            lambda result: file_declarations.setdefault(result[0], result[1]),
+            "Parsing files",
+            # inside of worker processes (e.g. of the evolutionary metrics), do not start even more of them
+            force_non_parallel=len(files_to_parse) < PARALLEL_PARSE_MIN_FILES or multiprocessing.parent_process() is not None,
+        )
+        for file in files:  # in file order, so that the tree looks the same no matter which files were cached
+            for logic_path, declaration in file_declarations[file.get_path()]:
+                found_nodes.register(logic_path, declaration)
         print("Found " + str(found_nodes.node_count()) + " directories, files, classes, methods and fields!")
         return found_nodes
 
     def __init__(self, parent: Optional['RepoTree'], name: str, ts_node=None):
         self.parent = parent
-        self.name = name
+        self.name = sys.intern(name)  # the same few names (constructor, toString, ...) appear all over the tree
         if parent is not None and len(name) == 0:
             print("I have no name! I live in: " + parent.get_path())
             pdb.set_trace()
-        self.ts_node = ts_node
-        self.additional_ts_nodes = []
-        self.children: Dict[str, 'RepoTree'] = {}
+        # either a tree-sitter node or a cached Declaration, which gets replaced by its tree-sitter node once that is needed
+        self.declaration = ts_node
+        self.additional_declarations: Tuple = ()
+        self.children: Mapping[str, 'RepoTree'] = _NO_CHILDREN
+        self.repo: Optional[LocalRepo] = None  # only set on the root, to find the files of cached declarations
+        self._path: Optional[str] = None
+        self._path_index: Optional[Dict[str, 'RepoTree']] = None  # only on the root, see find_node
 
     # to allow for pickling (for multiprocessing), see https://stackoverflow.com/a/2345985/4354423
     def __getstate__(self):
-        """Return state values to be pickled."""  # ignore ts_node, cannot be pickled
-        return (self.parent, self.name, self.children)
+        """Return state values to be pickled."""  # tree-sitter nodes cannot be pickled, so only their Declaration is
+        return (self.parent, self.name, None if self.children is _NO_CHILDREN else self.children, self.repo,
+                None if self.declaration is None else Declaration.of(self.declaration),
+                tuple(Declaration.of(d) for d in self.additional_declarations))
 
     def __setstate__(self, state):
         """Restore state from the unpickled state values."""
-        self.parent, self.name, self.children = state
+        self.parent, name, children, self.repo, self.declaration, self.additional_declarations = state
+        self.name = sys.intern(name)
+        self.children = _NO_CHILDREN if children is None else children
+        self._path = None
+        self._path_index = None
+
+    @property
+    def ts_node(self):
+        if isinstance(self.declaration, Declaration):
+            self._resolve_own_file()
+        return self.declaration
+
+    def _resolve_own_file(self):
+        """parse my file once and resolve all cached declarations in it, without keeping its tree in the repo's file cache"""
+        file_node = self.get_containing_file_node()
+        repo = self.get_root().repo
+        file_node.resolve_declarations(RepoFile(repo, repo.get_file(file_node.get_path()).file_obj))
+
+    def resolve_declarations(self, file: 'RepoFile'):
+        """replace the cached declarations of me and all my children by their tree-sitter nodes in the given file"""
+        root_ts_node = None
+        for node in self.traverse_gen():
+            if not isinstance(node.declaration, Declaration) and not any(isinstance(d, Declaration) for d in node.additional_declarations):
+                continue
+            if root_ts_node is None:
+                root_ts_node = file.get_tree().root_node
+            if isinstance(node.declaration, Declaration):
+                node.declaration = node._find_ts_node(root_ts_node, node.declaration)
+            node.additional_declarations = tuple(node._find_ts_node(root_ts_node, d) if isinstance(d, Declaration) else d for d in node.additional_declarations)
+
+    def _find_ts_node(self, ts_node, declaration: Declaration):
+        while (ts_node.type, ts_node.start_byte, ts_node.end_byte) != (declaration.type, declaration.start_byte, declaration.end_byte):
+            ts_node = next((child for child in ts_node.children if child.start_byte <= declaration.start_byte and declaration.end_byte <= child.end_byte), None)
+            if ts_node is None:
+                raise Exception("Cannot find the " + declaration.type + " of " + self.get_path() + " in its file anymore!")
+        return ts_node
 
     def get_root(self):
         if self.parent is None:
@@ -371,11 +641,13 @@ class RepoTree:
         return self.parent.get_root()
 
     def get_path(self) -> str:
-        if self.parent is None or len(self.parent.name) == 0:
-            return self.name
-        else:
-            # return "/".join(x.name for x in self.self_and_parents_gen())
-            return self.parent.get_path() + "/" + self.name
+        if self._path is None:  # nodes never move, so this can be kept once it is needed
+            if self.parent is None or len(self.parent.name) == 0:
+                self._path = self.name
+            else:
+                # return "/".join(x.name for x in self.self_and_parents_gen())
+                self._path = self.parent.get_path() + "/" + self.name
+        return self._path
 
     def get_java_name(self):
         """return the full java name to reference this node"""
@@ -399,7 +671,14 @@ class RepoTree:
             current = current.parent
 
     def register(self, path, ts_node):
-        self.register_list(path.split("/"), ts_node)
+        path_segments = path.split("/")
+        self.register_list(path_segments, ts_node)
+        root = self.get_root()
+        if root._path_index is not None:  # keep it up to date instead of building it again
+            node = self
+            for segment in path_segments:
+                node = node.children[segment]
+                root._path_index[node.get_path()] = node
 
     def register_list(self, path_segments, ts_node):
         if len(path_segments) > 1:
@@ -411,15 +690,23 @@ class RepoTree:
 
     def register_child(self, name, ts_node) -> 'RepoTree':
         if name not in self.children:  # new child with this name
+            if self.children is _NO_CHILDREN:
+                self.children = {}
             self.children[name] = RepoTree(self, name, ts_node)
-        elif self.children[name].ts_node is None:  # known child receives ts_node
-            self.children[name].ts_node = ts_node
-        elif ts_node is not None and ts_node != self.children[name].ts_node:  # this is a name collision (e.g. java method overloading) or a field and method sharing the same name
-            self.children[name].additional_ts_nodes.append(ts_node)
+        elif self.children[name].declaration is None:  # known child receives ts_node
+            self.children[name].declaration = ts_node
+        elif ts_node is not None and ts_node != self.children[name].declaration:  # this is a name collision (e.g. java method overloading) or a field and method sharing the same name
+            self.children[name].additional_declarations += (ts_node,)
         return self.children[name]
 
     def all_ts_nodes(self):
-        return [self.ts_node] + self.additional_ts_nodes
+        if any(isinstance(d, Declaration) for d in self.all_declarations()):
+            self._resolve_own_file()
+        return [self.ts_node, *self.additional_declarations]
+
+    def all_declarations(self):
+        """like all_ts_nodes, but without needing to parse any file"""
+        return [self.declaration, *self.additional_declarations]
 
     def has_node(self, path) -> bool:
         return self.find_node(path) is not None
@@ -427,9 +714,20 @@ class RepoTree:
     def find_node(self, path) -> 'RepoTree':
         if len(path) == 0:
             return self
+        elif self._has_path_index():
+            return self._get_path_index().get(path)
         else:
             return self.find_node_list(path.split("/"))
 
+    def _has_path_index(self) -> bool:
+        """only the root can answer lookups with its path index, since all paths are relative to it"""
+        return self.parent is None and len(self.name) == 0
+
+    def _get_path_index(self) -> Dict[str, 'RepoTree']:
+        if self._path_index is None:
+            self._path_index = {node.get_path(): node for node in self.traverse_gen() if node is not self}
+        return self._path_index
+
     def find_node_list(self, path_segments) -> Optional['RepoTree']:
         if len(path_segments) == 0:
             return self
@@ -439,9 +737,9 @@ class RepoTree:
             return None
 
     def get_type(self) -> Optional[str]:
-        if self.ts_node is None:
+        if self.declaration is None:
             return None
-        node_type = self.ts_node.type
+        node_type = self.declaration.type
         if node_type.endswith("_declaration"):
             node_type = node_type[0:-len("_declaration")]
         return node_type
@@ -482,7 +780,7 @@ class RepoTree:
         return None
 
     def is_file_node(self):
-        return self.ts_node is None and "." in self.name
+        return self.declaration is None and "." in self.name
 
     def get_children_of_type(self, type_str) -> List['RepoTree']:
         return [c for c in self.children.values() if c.get_type() == type_str]
@@ -493,7 +791,7 @@ class RepoTree:
 
     def find_descendant_matching_line_range(self, begin_line: int, end_line: int) -> 'RepoTree':
         for child in self.children.values():
-            if child.ts_node is not None and (child.ts_node.start_point[0] <= begin_line and end_line <= child.ts_node.end_point[0]):
+            if child.declaration is not None and (child.declaration.start_point[0] <= begin_line and end_line <= child.declaration.end_point[0]):
                 return child.find_descendant_matching_line_range(begin_line, end_line)
         return self
 
@@ -514,9 +812,9 @@ class RepoTree:
         return None
 
     def get_text(self, file: RepoFile) -> Optional[str]:
-        if self.ts_node is None:
+        if self.declaration is None:
             return None
-        return file.node_text(self.ts_node)
+        return file.node_text(self.declaration)
 
     def get_preceding_comment_text(self, file: RepoFile) -> Optional[str]:
         if self.parent is None or self.parent.ts_node is None:
@@ -541,18 +839,20 @@ class RepoTree:
         return file.node_text(previous_sibling)
 
     def get_comment_and_own_text(self, file: RepoFile) -> str:
-        # TODO incorporate self.additional_ts_nodes in here as well!
+        # TODO incorporate self.additional_declarations in here as well!
         return (self.get_preceding_comment_text(file) or "") + "\n" + self.get_text(file)
 
     def get_comment_and_own_text_formatted(self, file: RepoFile) -> str:
         return unindent_code_snippet(self.get_preceding_comment_text(file) or "") + "\n" + unindent_code_snippet(self.get_text(file))
 
     def get_line_span(self) -> int:
-        if self.ts_node is None:
+        if self.declaration is None:
             return 0
-        return self.ts_node.end_point[0] - self.ts_node.start_point[0] + 1
+        return self.declaration.end_point[0] - self.declaration.start_point[0] + 1
 
     def has(self, path) -> bool:
+        if self._has_path_index():
+            return path in self._get_path_index()
         return self.has_list(path.split("/"))
 
     def has_list(self, path_segments) -> bool:
@@ -601,22 +901,22 @@ class RepoTree:
         for other_child in other.children.values():
             if not self.has_child(other_child.name):
                 results.add(other_child.get_path())
-        if len(results) == 0 and self.ts_node is not None and other.ts_node is not None:  # TODO why can they be None?
+        if len(results) == 0 and self.declaration is not None and other.declaration is not None:  # TODO why can they be None?
             # TODO: instead check if the treesitter trees are equal!
-            my_content = decode(my_content_bytes[self.ts_node.start_byte:self.ts_node.end_byte])
-            other_content = decode(other_content_bytes[other.ts_node.start_byte:other.ts_node.end_byte])
+            my_content = decode(my_content_bytes[self.declaration.start_byte:self.declaration.end_byte])
+            other_content = decode(other_content_bytes[other.declaration.start_byte:other.declaration.end_byte])
             if my_content != other_content:
                 results.add(self.get_path())
         return results
 
     def probably_equals(self, other: 'RepoTree'):
-        return self.name == other.name and self.ts_node is not None and other.ts_node is not None and self.byte_range == other.byte_range
+        return self.name == other.name and self.declaration is not None and other.declaration is not None and self.byte_range == other.byte_range
 
     @property
     def byte_range(self):
-        if self.ts_node is None:
+        if self.declaration is None:
             return 0
-        return sum(node.end_byte - node.start_byte for node in self.all_ts_nodes())
+        return sum(node.end_byte - node.start_byte for node in self.all_declarations())
 
     def traverse_gen(self):
         # yield me and all my recursive children
@@ -1,3 +1,5 @@
+import hashlib
+
 from util import *
 from graph import *
 from local_repo import *
@@ -13,13 +15,24 @@ METRIC_GRAPH_CLASSES = {
     "module_distance": ModuleDistanceCouplingGraph,
 }
 
+# (method, arguments) calls on the freshly loaded graphs, see MetricsGeneration.post_*.
+# Their results are saved here, and recalculated whenever the raw graph or these steps change
+METRIC_POST_PROCESSING: Dict[str, List[Tuple[str, tuple]]] = {
+    "evolutionary": [],  # [("propagate_down", (2, 0.5))],
+    "references": [("propagate_down", (2, 0.5)), ("dilate", (1, 0.8))],
+    "linguistic": [],
+    "module_distance": [],
+}
+POST_PROCESSED_SAVE_PATH = METRICS_SAVE_PATH + "post_processed/"
+
 
 class MetricsGeneration:
     def __init__(self, repo: LocalRepo):
         self.repo = repo
+        self.graph_manager = graph_managers.for_repo(repo.name)
 
     def calculate_evolutionary_connections(self) -> ExplicitCouplingGraph:
-        coupling_graph = ExplicitCouplingGraph("evolutionary")
+        coupling_graph = ExplicitCouplingGraph("evolutionary", self.graph_manager)
 
         self.repo.get_tree()
         new_couple_by_same_commits(self.repo, coupling_graph)
@@ -28,12 +41,16 @@ class MetricsGeneration:
 
         return coupling_graph
 
+    @staticmethod
+    def post_process(coupling_graph: CouplingGraph, name: str):
+        for method, args in METRIC_POST_PROCESSING[name]:
+            getattr(coupling_graph, method)(*args)
+
     def post_evolutionary(self, coupling_graph: ExplicitCouplingGraph):
-        # coupling_graph.propagate_down(2, 0.5)
-        pass
+        self.post_process(coupling_graph, "evolutionary")
 
     def calculate_references_connections(self) -> ExplicitCouplingGraph:
-        coupling_graph = ExplicitCouplingGraph("references")
+        coupling_graph = ExplicitCouplingGraph("references", self.graph_manager)
 
         context = ReferencesContext(self.repo)
         context.couple_files_by_import(coupling_graph)
@@ -45,12 +62,10 @@ class MetricsGeneration:
         return coupling_graph
 
     def post_references(self, coupling_graph: ExplicitCouplingGraph):
-        coupling_graph.propagate_down(2, 0.5)
-        coupling_graph.dilate(1, 0.8)
-        pass
+        self.post_process(coupling_graph, "references")
 
     def calculate_linguistic_connections(self) -> SimilarityCouplingGraph:
-        coupling_graph = SimilarityCouplingGraph("linguistic")
+        coupling_graph = SimilarityCouplingGraph("linguistic", self.graph_manager)
 
         node_words = extract_topic_model_documents(self.repo.get_all_interesting_files())
         topics = train_topic_model(node_words)
@@ -59,10 +74,10 @@ class MetricsGeneration:
         return coupling_graph
 
     def post_linguistic(self, coupling_graph: SimilarityCouplingGraph):
-        pass
+        self.post_process(coupling_graph, "linguistic")
 
     def calculate_module_distance_connections(self) -> ModuleDistanceCouplingGraph:
-        return ModuleDistanceCouplingGraph()
+        return ModuleDistanceCouplingGraph(manager=self.graph_manager)
 
     def post_module_distance(self, coupling_graph: ModuleDistanceCouplingGraph):
         pass
@@ -80,25 +95,77 @@ class MetricManager:
         MetricManager.graph_cache.pop(MetricManager.cache_key(repo, name), None)
         if MetricManager._data_present(repo.name, name):
             os.remove(CouplingGraph.pickle_path(repo.name, name))
+        post_processed_path = CouplingGraph.pickle_path(repo.name, name, POST_PROCESSED_SAVE_PATH)
+        for path in [post_processed_path, post_processed_path + ".key"]:
+            if os.path.isfile(path):
+                os.remove(path)
 
     @staticmethod
     def get(repo: LocalRepo, name: str, ignore_post_processing=False) -> Union[ExplicitCouplingGraph, SimilarityCouplingGraph, ModuleDistanceCouplingGraph]:
         if MetricManager.cache_key(repo, name) in MetricManager.graph_cache:
             return MetricManager.graph_cache[MetricManager.cache_key(repo, name)]
+        if not ignore_post_processing:
+            graph = MetricManager._load_post_processed(repo, name)
+            if graph is not None:
+                MetricManager.graph_cache[MetricManager.cache_key(repo, name)] = graph
+                return graph
         if MetricManager._data_present(repo.name, name):
             graph = CouplingGraph.load(repo.name, name, METRIC_GRAPH_CLASSES[name])
         elif name == "module_distance":
-            graph = ModuleDistanceCouplingGraph()
+            graph = ModuleDistanceCouplingGraph(manager=graph_managers.for_repo(repo.name))
         else:
             print(f"No precalculated {name} values found for {repo.name}, starting calculations...")
             graph: CouplingGraph = getattr(MetricsGeneration(repo), "calculate_" + name + "_connections")()
             graph.print_statistics()
             graph.save(repo.name)
         if not ignore_post_processing:
+            key = MetricManager._post_processing_key(repo, name, graph)
             getattr(MetricsGeneration(repo), "post_" + name)(graph)
+            MetricManager._save_post_processed(repo, name, graph, key)
             MetricManager.graph_cache[MetricManager.cache_key(repo, name)] = graph
         return graph
 
+    @staticmethod
+    def _post_processing_key(repo: LocalRepo, name: str, raw_graph: Optional[CouplingGraph] = None) -> Optional[str]:
+        """hash of the saved raw graph and the post processing steps, None if there is nothing to cache"""
+        if len(METRIC_POST_PROCESSING[name]) == 0:
+            return None
+        if raw_graph is not None:
+            raw_graph.manager.flush()  # so that it is completely saved
+        if not MetricManager._data_present(repo.name, name):
+            return None
+        digest = hashlib.sha1()
+        with open(CouplingGraph.pickle_path(repo.name, name), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest() + " " + repr(METRIC_POST_PROCESSING[name])
+
+    @staticmethod
+    def _load_post_processed(repo: LocalRepo, name: str) -> Optional[CouplingGraph]:
+        key = MetricManager._post_processing_key(repo, name)
+        if key is None:
+            return None
+        key_path = CouplingGraph.pickle_path(repo.name, name, POST_PROCESSED_SAVE_PATH) + ".key"
+        if not os.path.isfile(key_path):
+            return None
+        with open(key_path) as f:
+            if f.read() != key:
+                return None
+        return CouplingGraph.load(repo.name, name, METRIC_GRAPH_CLASSES[name], path=POST_PROCESSED_SAVE_PATH)
+
+    @staticmethod
+    def _save_post_processed(repo: LocalRepo, name: str, graph: CouplingGraph, key: Optional[str]):
+        if key is None:
+            return
+        key_path = CouplingGraph.pickle_path(repo.name, name, POST_PROCESSED_SAVE_PATH) + ".key"
+        if os.path.isfile(key_path):
+            os.remove(key_path)
+        graph.save(repo.name, POST_PROCESSED_SAVE_PATH)
+        graph.manager.flush()
+        # written last, so that an incompletely saved graph is never used
+        with open(key_path, "w") as f:
+            f.write(key)
+
     @staticmethod
     def _data_present(repo_name: str, name: str):
         return os.path.isfile(CouplingGraph.pickle_path(repo_name, name))
@@ -76,10 +76,10 @@ def get_commit_diff(commit_hash, repo: LocalRepo) -> Optional[Set[str]]:
         path = diff.b_path  # in case of rename, stick to newer path, better chance at getting the right thing
         if not path.endswith("." + repo.type_extension()):
             return {path}
-        a_content = diff.a_blob.data_stream.read()
+        a_content = repo.get_blob(diff.a_blob.hexsha)
         if should_skip_file(a_content):
             return set()
-        b_content = diff.b_blob.data_stream.read()
+        b_content = repo.get_blob(diff.b_blob.hexsha)
         if should_skip_file(b_content):
             return set()
         a_tree = java_parser.parse(a_content)
@@ -186,10 +186,10 @@ def find_changed_methods(repo: LocalRepo, parent_diffs: List[List[Diff]]) -> Set
         path = diff.b_path
         if not path.endswith("." + repo.type_extension()):
             return {path}
-        a_content = diff.a_blob.data_stream.read()
+        a_content = repo.get_blob(diff.a_blob.hexsha)
         if should_skip_file(a_content):
             return set()
-        b_content = diff.b_blob.data_stream.read()
+        b_content = repo.get_blob(diff.b_blob.hexsha)
         if should_skip_file(b_content):
             return set()
         a_tree = java_parser.parse(a_content)
@@ -413,11 +413,11 @@ def new_couple_by_same_commits(repo: LocalRepo, coupling_graph: ExplicitCoupling
     #   within a time window (max one day?)
     #   or with similar messages (next to each other and named "foo" and "foo part 2")
     #  to be (somewhat) related, and couple methods of those within each other (somewhat)
+    usable_changes_per_commit: List[List[str]] = []
     for changes in log_progress(list(changes_per_commit.values()), desc="creating coupling graph"):
         usable_changes = [d for d in changes if repo.get_tree().has_node(d)]
         if MIN_COMMIT_METHODS <= len(usable_changes) <= MAX_COMMIT_METHODS:
-            score = 2 / len(usable_changes)
-            for f1, f2 in all_pairs(usable_changes):
-                coupling_graph.add(f1, f2, score)
-            for node in usable_changes:
-                coupling_graph.add_support(node, score)
+            usable_changes_per_commit.append(usable_changes)
+    # generators, so that the pairs are only created batch by batch
+    coupling_graph.add_many((f1, f2, 2 / len(changes)) for changes in usable_changes_per_commit for f1, f2 in all_pairs(changes))
+    coupling_graph.add_support_many((node, 2 / len(changes)) for changes in usable_changes_per_commit for node in changes)
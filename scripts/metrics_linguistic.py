@@ -117,8 +117,10 @@ def train_topic_model(node_words: List[Tuple[RepoTree, List[str]]]):
 
 
 def couple_by_topic_similarity(node_words: List[Tuple[RepoTree, List[str]]], doctop, coupling_graph: SimilarityCouplingGraph):
-    for (repo_tree, words), topics in log_progress(zip(node_words, doctop), total=len(node_words), desc="Generating coupling graph"):
-        if not all(x < 0.001 for x in topics):  # if it is not topic-less
-            coupling_graph.add_node(repo_tree.get_path(), topics, len(words))
+    if len(node_words) == 0:
+        return coupling_graph
+    doctop = np.asarray(doctop)
+    has_topics = np.flatnonzero(~np.all(doctop < 0.001, axis=1))  # skip the topic-less ones
+    coupling_graph.add_nodes([node_words[i][0].get_path() for i in has_topics], doctop[has_topics], [len(node_words[i][1]) for i in has_topics])
 
     return coupling_graph
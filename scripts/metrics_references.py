@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 
 from parsing import *
-from graph import ExplicitCouplingGraph
+from graph import ExplicitCouplingGraph, BULK_BATCH_SIZE
 from util import *
 from local_repo import *
 
@@ -369,27 +369,37 @@ class ReferencesContext:
                                 self.path_to_result_type_envs[path] = [result_type_env]
 
     def couple_files_by_import(self, coupling_graph: ExplicitCouplingGraph):
-        for file in log_progress(self.files, desc="Connecting files by imports"):
-            for imported_class_path in self.file_path_to_imports.get(file.get_path(), []):
-                coupling_graph.add_and_support(file.get_path(), imported_class_path, STRENGTH_FILE_IMPORT)
+        # a generator, so that the graph gets the edges batch by batch instead of all at once
+        coupling_graph.add_and_support_many((file.get_path(), imported_class_path, STRENGTH_FILE_IMPORT)
+                                            for file in log_progress(self.files, desc="Connecting files by imports")
+                                            for imported_class_path in self.file_path_to_imports.get(file.get_path(), []))
 
     def couple_by_inheritance(self, coupling_graph: ExplicitCouplingGraph):
+        coupling_graph.add_and_support_many(self._inheritance_edges())
+
+    def _inheritance_edges(self) -> Iterator[Tuple[str, str, float]]:
         for sub_type_path in log_progress(self.class_path_to_base_class_envs.keys(), desc="Connecting classes by inheritance"):
             super_type_envs = self.get_transitive_base_types(sub_type_path)
             sub_type_children_names = self.repo.get_tree().find_node(sub_type_path).children.keys()
             for super_type_env in super_type_envs:
-                coupling_graph.add_and_support(sub_type_path, super_type_env.path, STRENGTH_CLASS_INHERITANCE)
+                yield sub_type_path, super_type_env.path, STRENGTH_CLASS_INHERITANCE
                 super_type_env_ungeneric = super_type_env.get_ungeneric_env()
                 if super_type_env_ungeneric is not None:
                     super_type_node = super_type_env_ungeneric.node
                     for sub_child in sub_type_children_names:
                         if super_type_node.has_child(sub_child):
-                            coupling_graph.add_and_support(sub_type_path + "/" + sub_child, super_type_env.path + "/" + sub_child, STRENGTH_MEMBER_OVERRIDE)
+                            yield sub_type_path + "/" + sub_child, super_type_env.path + "/" + sub_child, STRENGTH_MEMBER_OVERRIDE
 
     def couple_members_by_content(self, coupling_graph: ExplicitCouplingGraph):
+        edges: List[Tuple[str, str, float]] = []
+
         def handler(a, b, strength):
-            coupling_graph.add_and_support(a, b, strength)
+            edges.append((a, b, strength))
+            if len(edges) >= BULK_BATCH_SIZE:  # flush in chunks, so that not all edges of the repo are kept in memory
+                coupling_graph.add_and_support_many(edges)
+                edges.clear()
         self.iterate_all_references(handler, "Connecting methods and fields by content")
+        coupling_graph.add_and_support_many(edges)
 
     def iterate_all_references(self, handler, progress_bar_title):
         # TODO make sure that the methods are also coupled to their parameter types and their return type
@@ -1,7 +1,6 @@
 from typing import *
 import math
 import random
-from collections import defaultdict
 from typing import cast
 
 import pyfiglet
@@ -45,9 +44,9 @@ def stats_relative_n_m(r, view):
     all_nodes = set(node.get_path() for node in LocalRepo.for_name(repo).get_tree().traverse_gen())
     max_n = len(all_nodes)
     max_m = (max_n * (max_n - 1)) / 2
-    node_names, _supports, edges = MetricManager.get(r, view).get_data()
-    n = len(set(node_names).intersection(all_nodes))
-    m = len([e for e in edges if e[2] != 0])
+    data = MetricManager.get(r, view).export_data()
+    n = len(set(data.node_names()).intersection(all_nodes))
+    m = np.count_nonzero(data.weights)
     return n / max_n, m / max_m
 
 
@@ -62,12 +61,9 @@ def stats_ling_relative_n(r):
 
 @cachier()
 def stats_node_degrees_edge_weights(r, view):
-    node_names, _supports, edges = MetricManager.get(r, view).get_data()
-    node_degrees = [0 for _n in node_names]
-    for n0, n1, w in edges:
-        node_degrees[n0] += w
-        node_degrees[n1] += w
-    edge_weights = [e[2] for e in edges]
+    data = MetricManager.get(r, view).export_data()
+    node_degrees = (np.bincount(data.sources, data.weights, len(data)) + np.bincount(data.targets, data.weights, len(data))).tolist()
+    edge_weights = data.weights.tolist()
     random.shuffle(node_degrees)
     random.shuffle(edge_weights)
     return node_degrees[:100000], edge_weights[:100000]
@@ -80,14 +76,11 @@ def stats_node_degrees_edge_weights_generic(r: LocalRepo, view: str) -> Tuple[Li
     print(r.name + " (" + view + "): " + str(len(all_nodes)))
     random.seed(42)
     all_nodes = random.sample(list(all_nodes), 2000)
-    node_degrees_dict = defaultdict(lambda: 0.0)
-    edge_weights = []
-    for n1, n2 in log_progress(list(all_pairs(all_nodes)), desc="Sampling edge data "):
-        w = g.get_normalized_coupling(n1, n2)
-        node_degrees_dict[n1] += w
-        node_degrees_dict[n2] += w
-        edge_weights.append(w)
-    return list(node_degrees_dict.values()), edge_weights
+    # same pairs as all_pairs(all_nodes), but as index arrays
+    second, first = np.tril_indices(len(all_nodes), -1)
+    edge_weights = g.get_normalized_couplings(first, second, all_nodes)
+    node_degrees = np.bincount(first, edge_weights, len(all_nodes)) + np.bincount(second, edge_weights, len(all_nodes))
+    return node_degrees.tolist(), edge_weights.tolist()
 
 
 
@@ -95,14 +88,10 @@ def stats_sampled_edge_weights(r, view, nodes=None):
     g = MetricManager.get(r, view)
     if nodes is None:
         nodes = list(g.get_node_set())
-    edge_weights = []
     n = len(nodes)
     sample_size = min(n, math.ceil(100000 / n))
-    for n1 in nodes:
-        samples = random.sample(nodes, sample_size)
-        for n2 in samples:
-            edge_weights.append(g.get_normalized_coupling(n1, n2))
-    return edge_weights
+    pairs = [(n1, n2) for n1 in nodes for n2 in random.sample(nodes, sample_size)]
+    return g.get_normalized_couplings(pairs).tolist()
 
 
 @cachier()